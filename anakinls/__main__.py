@@ -16,6 +16,7 @@
 import argparse
 import inspect
 import logging
+import sys
 
 from .server import server
 from .version import __copyright__, __version__
@@ -40,6 +41,12 @@ def main():
         '--port', type=int, default=2087, help='Bind to this port'
     )
 
+    parser.add_argument(
+        '--multi-client',
+        action='store_true',
+        help='Serve each TCP client by its own server process',
+    )
+
     parser.add_argument(
         '--version', action='store_true', help='Print version and exit'
     )
@@ -53,10 +60,18 @@ def main():
         return
 
     if args.v:
-        logging.basicConfig(level=logging.DEBUG)
+        logging.getLogger().setLevel(logging.DEBUG)
         logging.getLogger('pygls.protocol').setLevel(logging.DEBUG)
 
-    if args.tcp:
+    if args.multi_client:
+        if not args.tcp:
+            parser.error('--multi-client requires --tcp')
+        if sys.platform == 'win32':
+            parser.error('--multi-client is not supported on Windows')
+        from .tcp import serve
+
+        serve(args.host, args.port, ['-v'] if args.v else [])
+    elif args.tcp:
         server.start_tcp(args.host, args.port)
     else:
         server.start_io()
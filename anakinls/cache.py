@@ -0,0 +1,189 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Set by `cache_directory` initialization option
+cacheDirectory: Optional[str] = None
+
+
+def set_cache_directory(path: Optional[str]):
+    global cacheDirectory
+    cacheDirectory = path
+
+
+def get_cache_directory() -> str:
+    """Directory for the server's persistent caches."""
+    if cacheDirectory:
+        return cacheDirectory
+    if sys.platform == 'win32':
+        base = os.getenv('LOCALAPPDATA') or '~'
+    elif sys.platform == 'darwin':
+        base = '~/Library/Caches'
+    else:
+        base = os.getenv('XDG_CACHE_HOME') or '~/.cache'
+    return os.path.join(os.path.expanduser(base), 'anakinls')
+
+
+def prune_directory(path: str, max_size: int) -> int:
+    """Remove least recently used files until the directory fits the size.
+
+    A file is used when it is read or written. Return the number of
+    removed files.
+    """
+    files = []
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            files.append(
+                (max(st.st_atime, st.st_mtime), st.st_size, file_path)
+            )
+            total += st.st_size
+    files.sort()
+    removed = 0
+    for _used, size, file_path in files:
+        if total <= max_size:
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+class LRUCache:
+    """Least recently used cache.
+
+    Bounded by number of entries and by total size of values as returned
+    by `sizeof`. Zero means no limit.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 0,
+        max_size: int = 0,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._sizeof = sizeof
+        self._data: OrderedDict = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(
+        self,
+        key: Hashable,
+        default: Any = None,
+        is_valid: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Value of the key.
+
+        A value that `is_valid` rejects is counted as a miss and the
+        default is returned.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if is_valid is not None and not is_valid(value):
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._remove(key)
+            size = self._sizeof(value) if self._sizeof else 0
+            self._data[key] = value
+            self._sizes[key] = size
+            self._size += size
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, default)
+            self._remove(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def resize(self, max_entries: int, max_size: int):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_size = max_size
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._data),
+            'size': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def clear_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def format_stats(self) -> str:
+        return ' '.join(f'{k}={v}' for k, v in self.stats().items())
+
+    def _remove(self, key: Hashable):
+        if key in self._data:
+            del self._data[key]
+            self._size -= self._sizes.pop(key)
+
+    def _evict(self):
+        # Never evict the most recently used entry
+        while len(self._data) > 1 and (
+            (self.max_entries and len(self._data) > self.max_entries)
+            or (self.max_size and self._size > self.max_size)
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
@@ -0,0 +1,247 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import bisect
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pycodestyle import (  # type: ignore
+    SKIP_TOKENS,
+    WHITESPACE,
+    BaseReport,  # type: ignore
+    StyleGuide,
+)
+from pycodestyle import Checker as BaseChecker
+
+
+class CodestyleChecker(BaseChecker):
+    # Indent char of the whole file when only a part of it is checked
+    initial_indent_char: Optional[str] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.syntax_error = False
+        # Zero-based first rows of not indented logical lines with code:
+        # checker states before the line and whether the logical line
+        # is a single physical line. Check may start from such a line.
+        self.boundaries: Dict[int, Tuple[Dict, bool]] = {}
+
+    def report_invalid_syntax(self):
+        # Syntax errors are provided by Jedi. Just ignore pycodestyle.
+        self.syntax_error = True
+
+    def readline(self):
+        if self.indent_char is None:
+            self.indent_char = self.initial_indent_char
+        return super().readline()
+
+    def check_logical(self):
+        start = next(
+            (t[2] for t in self.tokens if t[0] not in SKIP_TOKENS), None
+        )
+        if start is None or start[1] != 0:
+            super().check_logical()
+            return
+        states = {k: dict(v) for k, v in self._checker_states.items()}
+        single = self.tokens[-1][2][0] == start[0]
+        super().check_logical()
+        if self.logical_line:
+            self.boundaries[start[0] - 1] = (states, single)
+
+
+class CodestyleReport(BaseReport):
+    def __init__(self, options):
+        super().__init__(options)
+        # Zero-based line, offset and text
+        self.errors: List[Tuple[int, int, str]] = []
+
+    def error(self, line_number, offset, text, check):
+        code = text[:4]
+        if self._ignore_code(code) or code in self.expected:
+            return
+        self.errors.append((line_number - 1, offset, text))
+
+
+class CodestyleResult(NamedTuple):
+    options: Any
+    lines: List[str]
+    indent_char: Optional[str]
+    errors: List[Tuple[int, int, str]]
+    boundaries: Dict[int, Tuple[Dict, bool]]
+
+
+# Unchanged lines around the edit which are checked again
+CONTEXT = 3
+
+
+def get_indent_char(lines: List[str]) -> Optional[str]:
+    return next((line[0] for line in lines if line[:1] in WHITESPACE), None)
+
+
+def run_check(
+    path: Optional[str],
+    lines: List[str],
+    options,
+    indent_char: Optional[str] = None,
+    states: Optional[Dict] = None,
+) -> Tuple[CodestyleChecker, CodestyleReport]:
+    report = CodestyleReport(options)
+    checker = CodestyleChecker(path, lines, options, report)
+    checker.initial_indent_char = indent_char
+    if states:
+        checker._checker_states = {k: dict(v) for k, v in states.items()}
+    checker.check_all()
+    return checker, report
+
+
+def check_incremental(
+    previous: CodestyleResult, path: Optional[str], lines: List[str]
+) -> Optional[CodestyleResult]:
+    # Check only lines between two not indented logical lines around the
+    # changed ones, reuse results of the previous check for the rest.
+    # Return None if the whole file must be checked.
+    old = previous.lines
+    if old == lines:
+        return previous
+    # Tabs and spaces check depends on the first indented line
+    indent_char = get_indent_char(lines)
+    if indent_char != previous.indent_char:
+        return None
+    size = min(len(old), len(lines))
+    start = 0
+    while start < size and old[start] == lines[start]:
+        start += 1
+    suffix = 0
+    while suffix < size - start and old[-1 - suffix] == lines[-1 - suffix]:
+        suffix += 1
+    old_end = len(old) - suffix
+    delta = len(lines) - len(old)
+    rows = sorted(previous.boundaries)
+
+    # Checking starts from the logical line before `keep_from`. Results
+    # for that line are wrong as there are no previous lines, so
+    # results of the previous check are used up to `keep_from`.
+    i = bisect.bisect_right(rows, start - CONTEXT) - 1
+    if i >= 1:
+        check_from, keep_from = rows[i - 1], rows[i]
+    else:
+        check_from = keep_from = 0
+
+    # Checking stops at the single line logical line `check_to`, so
+    # there is no blank line at the end of the checked lines. It is
+    # preceded by one more not indented logical line after the changed
+    # lines which resets the blank lines and previous lines state.
+    next_row: Optional[int] = None
+    check_to: Optional[int] = None
+    for row in rows[bisect.bisect_left(rows, old_end + CONTEXT) :]:
+        if next_row is None:
+            next_row = row
+        elif previous.boundaries[row][1]:
+            check_to = row
+            break
+    if check_to is None:
+        stop = len(lines)
+        chunk = lines[check_from:]
+    else:
+        stop = check_to + delta
+        chunk = lines[check_from : stop + 1]
+
+    checker, report = run_check(
+        path,
+        chunk,
+        previous.options,
+        indent_char,
+        previous.boundaries[check_from][0] if check_from else None,
+    )
+    if checker.syntax_error:
+        return None
+    boundaries = {
+        row + check_from: value for row, value in checker.boundaries.items()
+    }
+    errors = [
+        (line + check_from, offset, text)
+        for line, offset, text in report.errors
+    ]
+    # Indent char is changed after the error
+    if any(text.startswith('E101') for _, _, text in errors):
+        return None
+    if check_to is not None:
+        # Make sure that the rest of the file would be checked the same
+        assert next_row is not None
+        if next_row + delta not in boundaries or (
+            boundaries.get(stop, (None,))[0]
+            != previous.boundaries[check_to][0]
+        ):
+            return None
+    result = CodestyleResult(
+        previous.options,
+        lines,
+        indent_char,
+        [e for e in previous.errors if e[0] < keep_from],
+        {k: v for k, v in previous.boundaries.items() if k < keep_from},
+    )
+    result.errors.extend(e for e in errors if keep_from <= e[0] < stop)
+    result.boundaries.update(
+        (k, v) for k, v in boundaries.items() if keep_from <= k < stop
+    )
+    if check_to is not None:
+        result.errors.extend(
+            (line + delta, offset, text)
+            for line, offset, text in previous.errors
+            if line >= check_to
+        )
+        result.boundaries.update(
+            (k + delta, v)
+            for k, v in previous.boundaries.items()
+            if k >= check_to
+        )
+    return result
+
+
+def get_lines(code: str) -> List[str]:
+    if '\r' in code:
+        code = code.replace('\r\n', '\n').replace('\r', '\n')
+    return code.splitlines(True)
+
+
+def create_options(folder: str, config_file: Optional[str]):
+    kwargs: Dict[str, Any] = {'config_file': config_file}
+    if folder:
+        kwargs['paths'] = [folder]
+    return StyleGuide(**kwargs).options
+
+
+def check(
+    previous: Optional[CodestyleResult],
+    path: Optional[str],
+    lines: List[str],
+    options,
+) -> CodestyleResult:
+    """Check lines changed since the previous check or the whole file."""
+    if (
+        previous is not None
+        and previous.options is options
+        and not options.ast_checks
+        and not any(text.startswith('E101') for _, _, text in previous.errors)
+    ):
+        result = check_incremental(previous, path, lines)
+        if result is not None:
+            return result
+    checker, report = run_check(path, lines, options)
+    return CodestyleResult(
+        options,
+        lines,
+        get_indent_char(lines),
+        report.errors,
+        checker.boundaries,
+    )
@@ -0,0 +1,175 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import Any, Dict, Optional
+
+from jedi import create_environment, get_default_environment  # type: ignore
+from jedi.api.environment import (  # type: ignore
+    Environment,
+    InvalidPythonEnvironment,
+    _get_executable_path,
+    _VersionInfo,
+)
+
+from .cache import get_cache_directory
+
+CACHE_FILE = 'environments.json'
+
+
+class CachedEnvironment(Environment):
+    """Environment created from the cached metadata.
+
+    Unlike `Environment`, the interpreter is not started until Jedi needs
+    it for inference, and `sys_path` is known without asking it.
+    """
+
+    def __init__(self, executable: str, info: Dict[str, Any]):
+        self._start_executable = executable
+        self._env_vars = None
+        self.executable = info['executable']
+        self.path = info['path']
+        self.version_info = _VersionInfo(*info['version_info'])
+        self._sys_path = info['sys_path']
+
+    def get_sys_path(self):
+        return list(self._sys_path)
+
+    def adopt(self, environment: Environment) -> bool:
+        """Use interpreter of the same environment started elsewhere.
+
+        Return False if the environment differs from the cached one.
+        """
+        if _get_info(environment) != _get_info(self):
+            return False
+        if self._subprocess is None:
+            self._subprocess = environment._get_subprocess()
+        return True
+
+
+def _get_cache_path() -> str:
+    return os.path.join(get_cache_directory(), CACHE_FILE)
+
+
+def _get_mtime(executable: str) -> Optional[int]:
+    try:
+        return os.stat(executable).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _get_info(environment: Environment) -> Dict[str, Any]:
+    return {
+        'executable': environment.executable,
+        'path': environment.path,
+        'version_info': list(environment.version_info),
+        'sys_path': list(environment.get_sys_path()),
+    }
+
+
+def _load() -> Dict[str, Any]:
+    try:
+        with open(_get_cache_path(), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def find_executable(venv: Optional[str]) -> Optional[str]:
+    """Interpreter Jedi would start for the environment, without running it.
+
+    Return None if Jedi doesn't start an interpreter for it.
+    """
+    if venv:
+        if os.path.isfile(venv):
+            return venv
+        return _get_executable_path(venv, safe=False)
+    # Same as `get_default_environment` does
+    for var in ('VIRTUAL_ENV', 'CONDA_PREFIX'):
+        value = os.environ.get(var)
+        if not value or os.path.realpath(value) == os.path.realpath(
+            sys.prefix
+        ):
+            continue
+        try:
+            return _get_executable_path(value, safe=False)
+        except InvalidPythonEnvironment:
+            continue
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    return None
+
+
+def get_environment(venv: Optional[str]) -> Environment:
+    """Jedi environment of the venv or the default one.
+
+    The environment is created from the cached metadata if the interpreter
+    wasn't changed since it was stored.
+    """
+    executable = find_executable(venv)
+    if executable is not None:
+        entry = _load().get(executable)
+        if (
+            isinstance(entry, dict)
+            and entry.get('mtime') == _get_mtime(executable)
+            and entry.get('info')
+        ):
+            try:
+                return CachedEnvironment(executable, entry['info'])
+            except (KeyError, TypeError):
+                pass
+    if venv:
+        return create_environment(venv, safe=False)
+    return get_default_environment()
+
+
+def store(environment: Environment):
+    """Store metadata of the environment.
+
+    Asks the interpreter for `sys_path`, so must not run alongside other
+    Jedi work with the environment.
+    """
+    executable = getattr(environment, '_start_executable', None)
+    if not isinstance(environment, Environment) or not executable:
+        return
+    mtime = _get_mtime(executable)
+    if mtime is None:
+        return
+    data = _load()
+    data[executable] = {'mtime': mtime, 'info': _get_info(environment)}
+    directory = get_cache_directory()
+    path = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Other servers may read the file meanwhile
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path, _get_cache_path())
+    except OSError:
+        logging.exception('Failed to store Jedi environment metadata')
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+def revalidate(environment: CachedEnvironment) -> Environment:
+    """Start the interpreter of the cached environment and store it again."""
+    result = Environment(environment._start_executable)
+    store(result)
+    return result
@@ -0,0 +1,135 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import re
+import tokenize
+from typing import List, Optional, Tuple
+
+from parso import split_lines  # type: ignore
+from yapf.yapflib.yapf_api import FormatCode  # type: ignore
+
+# Lines searched up for the beginning of the statement
+MAX_STATEMENT_LINES = 1000
+
+RE_KEYWORD = re.compile(r'[ \t]*(\w+)')
+
+# Statements which can't be parsed without the preceding clause
+CLAUSE_PREFIXES = {
+    'else': 'if True:',
+    'elif': 'if True:',
+    'except': 'try:',
+    'finally': 'try:',
+}
+
+SKIP_TOKENS = {
+    tokenize.NL,
+    tokenize.COMMENT,
+    tokenize.INDENT,
+    tokenize.DEDENT,
+    tokenize.ENDMARKER,
+}
+
+
+def find_statement(lines: List[str], line: int) -> Optional[Tuple[int, bool]]:
+    """First line of the statement ending on the line.
+
+    Also return whether the statement is a compound statement header.
+    Return None if there is no complete statement ending on the line.
+    """
+    # Tokenize from the nearest not indented line, which most likely
+    # starts a statement.
+    anchor = line
+    while anchor > 0 and (
+        lines[anchor][:1] in ('', ' ', '\t', '\r', '\n', '#', ')', ']', '}')
+    ):
+        anchor -= 1
+        if line - anchor > MAX_STATEMENT_LINES:
+            return None
+    start = None
+    last = None
+    try:
+        for token in tokenize.generate_tokens(
+            iter(lines[anchor : line + 1]).__next__
+        ):
+            if token.type == tokenize.NEWLINE:
+                if anchor + token.start[0] - 1 == line and start is not None:
+                    return start, last == ':'
+                start = None
+            elif token.type not in SKIP_TOKENS and start is None:
+                start = anchor + token.start[0] - 1
+            if token.type not in SKIP_TOKENS:
+                last = token.string
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return None
+
+
+def format_statement(
+    lines: List[str],
+    line: int,
+    style_config: str,
+    indent_width: int,
+    header_only: bool = False,
+) -> Optional[Tuple[int, List[str]]]:
+    """Format the statement ending on the line alone.
+
+    Return the first line of the statement and its formatted lines, or
+    None if the statement can't be formatted on its own.
+    """
+    found = find_statement(lines, line)
+    if found is None:
+        return None
+    start, header = found
+    if header_only and not header:
+        return None
+    statement = [s.rstrip('\r\n') for s in lines[start : line + 1]]
+    newline = lines[start][len(statement[0]) :] or '\n'
+    indent = statement[0][: len(statement[0]) - len(statement[0].lstrip())]
+    # Put the statement in blocks of the same depth, so yapf sees the
+    # real line width
+    if indent.strip(' ') or len(indent) % indent_width:
+        return None
+    depth = len(indent) // indent_width
+    prefix = [' ' * (i * indent_width) + 'if True:\n' for i in range(depth)]
+    match = RE_KEYWORD.match(statement[0])
+    clause = CLAUSE_PREFIXES.get(match.group(1)) if match else None
+    if clause:
+        prefix.extend(
+            (f'{indent}{clause}\n', f'{indent}{" " * indent_width}pass\n')
+        )
+    suffix = [f'{indent}{" " * indent_width}pass\n'] if header else []
+    code = ''.join(prefix + [s + '\n' for s in statement] + suffix)
+    try:
+        formatted, _ = FormatCode(
+            code,
+            style_config=style_config,
+            lines=[(len(prefix) + 1, len(prefix) + len(statement))],
+        )
+    except Exception:
+        return None
+    result = split_lines(formatted, keepends=True)[:-1]
+    if (
+        result[: len(prefix)] != prefix
+        or result[len(result) - len(suffix) :] != suffix
+    ):
+        return None
+    result = [
+        s.rstrip('\n') + newline
+        for s in result[len(prefix) : len(result) - len(suffix)]
+    ]
+    while result and not result[0].strip():
+        del result[0]
+    if result and not lines[line].endswith(('\r', '\n')):
+        result[-1] = result[-1].rstrip('\r\n')
+    return start, result
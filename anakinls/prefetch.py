@@ -0,0 +1,51 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Container, List
+
+from jedi import Script  # type: ignore
+
+
+def get_imported_paths(
+    script: Script, skip: Container[str], limit: int
+) -> List[str]:
+    """Paths of the Python modules imported by the script module.
+
+    Jedi parses the modules while resolving the imports, so they are in
+    the parser cache afterwards. Paths in `skip` are not returned and at
+    most `limit` paths are returned.
+    """
+    result = []
+    own_path = str(script.path) if script.path else None
+    for import_ in script._module_node.iter_imports():
+        for names in import_.get_paths():
+            if len(result) >= limit:
+                return result
+            line, column = names[-1].start_pos
+            try:
+                definitions = script.goto(line, column, follow_imports=True)
+            except Exception:
+                continue
+            for definition in definitions:
+                path = definition.module_path
+                if path is None or path.suffix not in ('.py', '.pyi'):
+                    continue
+                path = str(path)
+                if (
+                    path != own_path
+                    and path not in skip
+                    and path not in result
+                ):
+                    result.append(path)
+    return result
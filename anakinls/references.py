@@ -0,0 +1,183 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import re
+from typing import Callable, Dict, Iterable, List, Optional
+
+from jedi import Script  # type: ignore
+from jedi.api import helpers  # type: ignore
+from jedi.api.classes import Name  # type: ignore
+from jedi.file_io import KnownContentFileIO  # type: ignore
+from jedi.inference.imports import load_module_from_path  # type: ignore
+from jedi.inference.references import (  # type: ignore
+    _dictionarize,
+    _find_defining_names,
+    _find_names,
+)
+from parso import python_bytes_to_unicode  # type: ignore
+
+from .symbols import iter_python_files
+
+# Same limits as Jedi uses for `Script.get_references`
+MAX_OPENED_FILES = 2000
+MAX_PARSED_FILES = 30
+
+
+class ReferenceSearch:
+    """References of a name, searched module by module.
+
+    This is what `Script.get_references` does, split into steps, so the
+    caller can report references of each module as soon as it is
+    searched. All the methods except `find_candidates` use Jedi and
+    must be called from the Jedi thread.
+    """
+
+    def __init__(self, script: Script, line: int, column: int):
+        self.script = script
+        self.line = line
+        self.column = column
+        self.name = ''
+        self.project_wide = False
+        self._found: Dict = {}
+        self._non_matching: Dict = {}
+        self._reported: set = set()
+        self._searched: set = set()
+
+    def start(self) -> List[Name]:
+        """Definitions of the name and references in the script module."""
+        inference_state = self.script._inference_state
+        inference_state.reset_recursion_limitations()
+        module_context = self.script._get_module_context()
+        tree_name = self.script._module_node.get_name_of_position(
+            (self.line, self.column)
+        )
+        if tree_name is None:
+            return []
+        self.name = tree_name.value
+        # Flow analysis is disabled, so both sides of e.g. `if` are found
+        try:
+            inference_state.flow_analysis_enabled = False
+            found_names = _find_defining_names(module_context, tree_name)
+        finally:
+            inference_state.flow_analysis_enabled = True
+        self._found = _dictionarize(found_names)
+        # Names of parameters are not searched in other modules and short
+        # names are too common to be worth it, as in Jedi
+        self.project_wide = len(self.name) > 2 and not any(
+            n.api_type == 'param' for n in found_names
+        )
+        self._search_module(module_context)
+        # Definitions outside of the project, e.g. in site-packages or
+        # stubs, are returned, but their modules aren't searched for other
+        # references, same as in Jedi
+        project_path = inference_state.project.path
+        for m in {d.get_root_context() for d in found_names}:
+            if (
+                m != module_context
+                and m.tree_node is not None
+                and project_path in m.py__file__().parents
+            ):
+                self._search_module(m)
+        return self._collect()
+
+    def find_candidates(
+        self,
+        roots: Iterable[str],
+        sources: Dict[str, str],
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> List[str]:
+        """Paths of the files under the roots mentioning the name.
+
+        The text of open documents is taken from the sources. Files are
+        only read here, so this doesn't have to run in the Jedi thread.
+        """
+        if not self.project_wide:
+            return []
+        pattern = r'\b' + re.escape(self.name) + r'\b'
+        regex = re.compile(pattern)
+        # Non ASCII characters are not word characters for bytes pattern,
+        # which may only let more files through
+        bytes_regex = re.compile(pattern.encode())
+        result = []
+        opened = 0
+        for root in roots:
+            for path in iter_python_files(root):
+                if opened >= MAX_OPENED_FILES or (
+                    should_stop and should_stop()
+                ):
+                    return result
+                if path in self._searched:
+                    continue
+                opened += 1
+                source = sources.get(path)
+                if source is not None:
+                    if regex.search(source):
+                        result.append(path)
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        if bytes_regex.search(f.read()):
+                            result.append(path)
+                except OSError:
+                    continue
+        return result
+
+    def search_file(
+        self, path: str, source: Optional[str] = None
+    ) -> List[Name]:
+        """References in the file that weren't returned before."""
+        if path in self._searched:
+            return []
+        if source is None:
+            try:
+                with open(path, 'rb') as f:
+                    source = python_bytes_to_unicode(
+                        f.read(), errors='replace'
+                    )
+            except OSError:
+                return []
+        module = load_module_from_path(
+            self.script._inference_state, KnownContentFileIO(path, source)
+        )
+        if module.is_compiled():
+            return []
+        self._search_module(module.as_context())
+        return self._collect()
+
+    def _search_module(self, module_context):
+        path = module_context.py__file__()
+        if path is not None:
+            self._searched.add(str(path))
+        used_names = module_context.tree_node.get_used_names()
+        for name_leaf in used_names.get(self.name, []):
+            new = _dictionarize(_find_names(module_context, name_leaf))
+            if any(tree_name in self._found for tree_name in new):
+                self._found.update(new)
+                for tree_name in new:
+                    # The name matches one of the names seen before, which
+                    # didn't match anything then
+                    for names in self._non_matching.pop(tree_name, []):
+                        self._found.update(names)
+            else:
+                for tree_name in new:
+                    self._non_matching.setdefault(tree_name, []).append(new)
+
+    def _collect(self) -> List[Name]:
+        inference_state = self.script._inference_state
+        result = []
+        for key, name in self._found.items():
+            if key not in self._reported:
+                self._reported.add(key)
+                result.append(Name(inference_state, name))
+        return helpers.sorted_definitions(result)
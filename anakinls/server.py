@@ -13,35 +13,75 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import ast
+import asyncio
+import atexit
+import hashlib
 import logging
+import multiprocessing
+import os
 import re
-from difflib import Differ
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from difflib import Differ, SequenceMatcher
+from functools import partial
 from inspect import Parameter
-from typing import Any, Callable, Dict, Iterator, List, Optional, Union
-
-from jedi import (  # type: ignore
-    RefactoringError,
-    Script,
-    create_environment,
-    get_default_environment,
-    get_default_project,
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
 )
+
+import parso.cache  # type: ignore
+from jedi import RefactoringError, Script, get_default_project  # type: ignore
 from jedi import settings as jedi_settings
 from jedi.api.classes import Completion, Name  # type: ignore
+from jedi.api.environment import InvalidPythonEnvironment  # type: ignore
 from jedi.api.refactoring import Refactoring  # type: ignore
 from lsprotocol import types
-from pycodestyle import BaseReport as CodestyleBaseReport  # type: ignore
-from pycodestyle import Checker as CodestyleBaseChecker
-from pycodestyle import StyleGuide as CodestyleStyleGuide
-from pyflakes.api import check as pyflakes_check  # type: ignore
+from parso import split_lines  # type: ignore
 from pygls.protocol import LanguageServerProtocol, lsp_method
 from pygls.server import LanguageServer
-from pygls.uris import to_fs_path
-from yapf.yapflib.yapf_api import FormatCode  # type: ignore
+from pygls.uris import from_fs_path, to_fs_path
 
+from .cache import (
+    LRUCache,
+    get_cache_directory,
+    prune_directory,
+    set_cache_directory,
+)
+from .environment import CachedEnvironment, get_environment
+from .environment import revalidate as revalidate_environment
+from .environment import store as store_environment
+from .prefetch import get_imported_paths
+from .references import MAX_PARSED_FILES as MAX_REFERENCES_PARSED_FILES
+from .references import ReferenceSearch
+from .stats import Stats
+from .symbols import SymbolIndex, iter_python_files
 from .version import __version__
+from .warmup import MAX_MODULES as MAX_WARM_UP_MODULES
+from .warmup import get_most_imported
+
+if TYPE_CHECKING:
+    from .codestyle import CodestyleResult
 
 RE_WORD = re.compile(r'\w*')
+# Windows paths contain colons too
+RE_MYPY_LINE = re.compile(r'^(.*?):(\d+):(\d+): (\w+): (.*)$')
 
 
 _COMPLETION_TYPES = {
@@ -57,7 +97,7 @@ _COMPLETION_TYPES = {
 
 
 completionFunction: Callable[
-    [List[Completion], types.Range], Iterator[types.CompletionItem]
+    [List[Completion], types.Range, int], Iterator[types.CompletionItem]
 ]
 documentSymbolFunction: Union[
     Callable[[str, List[str], List[Name]], List[types.DocumentSymbol]],
@@ -68,7 +108,71 @@ hoverMarkup: types.MarkupKind = types.MarkupKind.PlainText
 hoverFunction: Callable[[Name], str]
 
 
+def _touch_document(params):
+    uri = getattr(getattr(params, 'text_document', None), 'uri', None)
+    if uri is not None:
+        recentDocuments.pop(uri, None)
+        recentDocuments[uri] = None
+
+
+def _log_sys_path(environment):
+    logging.debug('Jedi environment sys_path:')
+    for p in environment.get_sys_path():
+        logging.debug(f'  {p}')
+
+
+def _store_environment(environment):
+    try:
+        store_environment(environment)
+    except Exception:
+        logging.exception('Failed to store Jedi environment metadata')
+
+
+def _revalidate_environment(environment: CachedEnvironment):
+    # Interpreter or its packages may have changed since the metadata was
+    # stored. Start it apart from Jedi thread and replace the environment
+    # if so.
+    try:
+        fresh = revalidate_environment(environment)
+    except InvalidPythonEnvironment:
+        logging.exception('Failed to revalidate Jedi environment')
+        return
+    jediExecutor.submit(_replace_environment, environment, fresh)
+
+
+def _replace_environment(cached: CachedEnvironment, fresh):
+    global jediEnvironment
+    if jediEnvironment is not cached or cached.adopt(fresh):
+        return
+    logging.info('Jedi environment changed since the last start')
+    jediEnvironment = fresh
+    scripts.clear()
+
+
 class AnakinLanguageServerProtocol(LanguageServerProtocol):
+    def _handle_request(self, msg_id, method_name, params):
+        _touch_document(params)
+        start = time.perf_counter()
+        super()._handle_request(msg_id, method_name, params)
+        future = self._request_futures.get(msg_id)
+        if future is None:
+            stats.record(method_name, time.perf_counter() - start)
+        else:
+
+            def _done(future):
+                if not future.cancelled():
+                    stats.record(method_name, time.perf_counter() - start)
+
+            future.add_done_callback(_done)
+
+    def _handle_notification(self, method_name, params):
+        # Time spent in the handler. Work scheduled by the handler, such
+        # as diagnostics, is timed on its own.
+        _touch_document(params)
+        start = time.perf_counter()
+        super()._handle_notification(method_name, params)
+        stats.record(method_name, time.perf_counter() - start)
+
     @lsp_method(types.INITIALIZE)
     def lsp_initialize(
         self, params: types.InitializeParams
@@ -80,19 +184,50 @@ class AnakinLanguageServerProtocol(LanguageServerProtocol):
         global documentSymbolFunction
         global hoverMarkup
         global hoverFunction
+        global symbolIndexEnabled
+        global warmUp
+        global cacheMaxSize
+        global cachePrepopulate
         if params.initialization_options:
             venv = params.initialization_options.get('venv', None)
+            symbolIndexEnabled = params.initialization_options.get(
+                'symbol_index', True
+            )
+            warmUp = params.initialization_options.get('warm_up', False)
+            cache_directory = params.initialization_options.get(
+                'cache_directory', None
+            )
+            cacheMaxSize = params.initialization_options.get(
+                'cache_max_size', 0
+            )
+            cachePrepopulate = params.initialization_options.get(
+                'cache_prepopulate', False
+            )
         else:
             venv = None
-        if venv:
-            jediEnvironment = create_environment(venv, safe=False)
+            cache_directory = None
+        if cache_directory:
+            set_cache_directory(os.path.expanduser(cache_directory))
+            jedi_settings.cache_directory = os.path.join(
+                get_cache_directory(), 'jedi'
+            )
+        jediEnvironment = get_environment(venv)
+        if isinstance(jediEnvironment, CachedEnvironment):
+            threading.Thread(
+                target=_revalidate_environment,
+                args=(jediEnvironment,),
+                name='anakinls-environment',
+                daemon=True,
+            ).start()
         else:
-            jediEnvironment = get_default_environment()
-        jediProject = get_default_project(getattr(params, 'rootPath', None))
+            # Next start will use the stored metadata
+            jediExecutor.submit(_store_environment, jediEnvironment)
+        jediProject = get_default_project(self.workspace.root_path or None)
         logging.info(f'Jedi environment python: {jediEnvironment.executable}')
-        logging.info('Jedi environment sys_path:')
-        for p in jediEnvironment.get_sys_path():
-            logging.info(f'  {p}')
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # Jedi asks the environment for sys_path anyway. Do it in the
+            # Jedi thread so the initialize result is sent meanwhile.
+            jediExecutor.submit(_log_sys_path, jediEnvironment)
         logging.info(f'Jedi project path: {jediProject._path}')
 
         def get_attr(o, *attrs):
@@ -134,9 +269,40 @@ server = LanguageServer(
     protocol_cls=AnakinLanguageServerProtocol,
 )
 
-scripts: Dict[str, Script] = {}
+# Rough memory used by a Jedi script per character of the code
+SCRIPT_SIZE_FACTOR = 200
+
+# Document version and Jedi script of the document. Bounded by
+# `script_cache_max_entries` and `script_cache_max_size` of the config.
+scripts = LRUCache(
+    sizeof=lambda entry: len(entry[1]._code) * SCRIPT_SIZE_FACTOR
+)
 pycodestyleOptions: Dict[str, Any] = {}
+# Results of the last pycodestyle check of the document
+codestyleResults = LRUCache(max_entries=100)
+# Diagnostics of each checker by document, hash of the document content
+# and the checker configuration
+diagnosticsCache = LRUCache(max_entries=1000)
+# Hash of the document content on the disk
+savedHashes: Dict[str, str] = {}
+# Open documents from the least to the most recently used
+recentDocuments: Dict[str, None] = {}
+# Document version and hover and signature help results by position.
+# Dropped on document change.
+positionResults: Dict[str, Tuple[Optional[int], Dict[Tuple, Any]]] = {}
+MAX_POSITION_RESULTS = 100
+# Changed on save of a changed document: mypy results of every document
+# may depend on it
+mypyGeneration = 0
 mypyConfigs: Dict[str, str] = {}
+# Workspace folders lookup, built on the first use after folders change
+workspaceFolders: Optional['FolderTrie'] = None
+# Workspace folder path by document uri
+workspaceFolderPaths: Dict[str, str] = {}
+# yapf style config and indent width by workspace folder
+yapfStyles: Dict[str, Tuple[str, int]] = {}
+# Files yapf reads style from
+YAPF_STYLE_FILES = ('.style.yapf', 'setup.cfg', 'pyproject.toml')
 
 jediEnvironment = None
 jediProject = None
@@ -144,42 +310,170 @@ jediProject = None
 completionPrefixPlain = 'a'
 completionPrefixSnippet = 'z'
 
+# Completions of the last `textDocument/completion` request to resolve
+# documentation for
+completionRequest = 0
+lastCompletions: List[Completion] = []
+
 jediHoverFunction = Script.help
 
+# Workspace symbols
+symbolIndex: Optional[SymbolIndex] = None
+symbolIndexEnabled = True
+symbolIndexStop = threading.Event()
+
+# Modules to load into Jedi caches after initialization. `True` means the
+# modules imported by the most of the project files.
+warmUp: Union[bool, List[str]] = False
+warmUpTask: Optional[asyncio.Task] = None
+# Seconds to wait for the requests to be done before warming up the next
+# module or prefetching the next file
+WARM_UP_WAIT = 0.1
+# Jedi parser cache: maximum size in megabytes, whether to parse the
+# project files into it after initialization
+cacheMaxSize = 0
+cachePrepopulate = False
+cacheTask: Optional[asyncio.Task] = None
+# Prefetching imports of the open documents by document, and paths of the
+# modules already prefetched
+prefetchTasks: Dict[str, asyncio.Task] = {}
+prefetchedPaths: Set[str] = set()
+
 config = {
     'pyflakes_errors': ['UndefinedName'],
     'pycodestyle_config': None,
     'help_on_hover': True,
     'mypy_enabled': False,
+    'mypy_daemon': False,
     'completion_snippet_first': False,
     'completion_fuzzy': False,
     'diagnostic_on_open': True,
     'diagnostic_on_save': True,
     'diagnostic_on_change': False,
-    'yapf_style_config': 'pep8',
+    'diagnostic_debounce': 500,
+    'diagnostic_max_wait': 2000,
+    'script_cache_max_entries': 100,
+    'script_cache_max_size': 256,
+    'yapf_style_config': None,
+    'format_on_save': False,
+    'stats_log_interval': 0,
+    'diagnostic_processes': min(os.cpu_count() or 1, 4),
+    'prefetch_depth': 0,
+    'prefetch_max_files': 100,
 }
 
+
+def _resize_scripts():
+    scripts.resize(
+        config['script_cache_max_entries'],
+        config['script_cache_max_size'] * 1024 * 1024,
+    )
+
+
+_resize_scripts()
+
+# Timings of requests and diagnostics phases
+stats = Stats()
+statsLogHandle: Optional[asyncio.TimerHandle] = None
+
 differ = Differ()
 
 
-def get_script(ls: LanguageServer, uri: str, update: bool = False) -> Script:
-    result = None if update else scripts.get(uri)
-    if not result:
-        document = ls.workspace.get_text_document(uri)
-        result = Script(
-            code=document.source,
-            path=document.path,
-            environment=jediEnvironment,
-            project=jediProject,
+class JediExecutor(ThreadPoolExecutor):
+    """Single worker executor which knows if any work is pending."""
+
+    def __init__(self):
+        super().__init__(max_workers=1, thread_name_prefix='anakinls-jedi')
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._pending_lock:
+            self._pending += 1
+        future = super().submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def is_idle(self) -> bool:
+        return self._pending == 0
+
+
+# Long Jedi operations run here, so the event loop is free to handle
+# `$/cancelRequest` meanwhile. One worker: Jedi is not thread safe.
+jediExecutor = JediExecutor()
+
+
+# Processes checking all open documents at once, e.g. after configuration
+# change. Started on the first use.
+processPool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global processPool
+    if processPool is None:
+        # Don't fork: the forked process would inherit locks held by the
+        # server threads.
+        processPool = ProcessPoolExecutor(
+            max_workers=config['diagnostic_processes'],
+            mp_context=multiprocessing.get_context('spawn'),
         )
-        scripts[uri] = result
+    return processPool
+
+
+def _shutdown_process_pool():
+    global processPool
+    if processPool is not None:
+        if sys.version_info >= (3, 9):
+            processPool.shutdown(wait=False, cancel_futures=True)
+        else:
+            processPool.shutdown(wait=False)
+        processPool = None
+
+
+async def _run_jedi(fn: Callable, *args, **kwargs) -> Any:
+    # Awaiting is a cancellation point. Work of a cancelled request
+    # which hasn't started yet is dropped from the queue.
+    return await asyncio.get_running_loop().run_in_executor(
+        jediExecutor, partial(fn, *args, **kwargs)
+    )
+
+
+def _get_script(
+    uri: str, code: str, path: Optional[str], version: Optional[int]
+) -> Script:
+    # Scripts are built lazily, by the first request after the document
+    # is changed. Jedi gives parso's diff parser the module of the
+    # previous script with the same path, so unchanged nodes are reused.
+    # A script of other version is a miss
+    cached: Optional[Tuple[Optional[int], Script]] = scripts.get(
+        uri, is_valid=lambda entry: entry[0] == version
+    )
+    if cached:
+        return cached[1]
+    result = Script(
+        code=code, path=path, environment=jediEnvironment, project=jediProject
+    )
+    scripts[uri] = (version, result)
     return result
 
 
+async def get_script_async(ls: LanguageServer, uri: str) -> Script:
+    # Parsing updates the parso module that the previous script of the
+    # document uses, so it must not run alongside other Jedi work.
+    document = ls.workspace.get_text_document(uri)
+    return await _run_jedi(
+        _get_script, uri, document.source, document.path, document.version
+    )
+
+
 class PyflakesReporter:
-    def __init__(self, result, script, errors):
+    def __init__(self, result, lines, errors):
         self.result = result
-        self.script = script
+        self.lines = lines
         self.errors = errors
 
     def unexpectedError(self, _filename, msg):
@@ -196,7 +490,7 @@ class PyflakesReporter:
         )
 
     def _get_codeline(self, line):
-        return self.script._code_lines[line].rstrip('\n\r')
+        return self.lines[line].rstrip('\n\r')
 
     def syntaxError(self, *args, **kwargs):
         # Syntax errors are provided by Jedi. Just ignore pyflakes.
@@ -223,73 +517,112 @@ class PyflakesReporter:
         )
 
 
-class CodestyleChecker(CodestyleBaseChecker):
-    def report_invalid_syntax(self):
-        # Syntax errors are provided by Jedi. Just ignore pycodestyle.
-        pass
+def _check_codestyle(
+    uri: str, path: Optional[str], code: str, options
+) -> List[types.Diagnostic]:
+    from . import codestyle
 
+    lines = codestyle.get_lines(code)
+    result = codestyle.check(codestyleResults.get(uri), path, lines, options)
+    codestyleResults[uri] = result
+    return _codestyle_diagnostics(lines, result.errors)
 
-class CodestyleReport(CodestyleBaseReport):
-    def __init__(self, options, result):
-        super().__init__(options)
-        self.result = result
 
-    def error(self, line_number, offset, text, check):
-        code = text[:4]
-        if self._ignore_code(code) or code in self.expected:
-            return
-        line = line_number - 1
-        self.result.append(
-            types.Diagnostic(
-                range=types.Range(
-                    start=types.Position(line=line, character=offset),
-                    end=types.Position(
-                        line=line,
-                        character=len(self.lines[line].rstrip('\n\r')),
-                    ),
+def _codestyle_diagnostics(
+    lines: List[str], errors: List[Tuple[int, int, str]]
+) -> List[types.Diagnostic]:
+    return [
+        types.Diagnostic(
+            range=types.Range(
+                start=types.Position(line=line, character=offset),
+                end=types.Position(
+                    line=line, character=len(lines[line].rstrip('\n'))
                 ),
-                message=text,
-                severity=types.DiagnosticSeverity.Warning,
-                code=code,
-                source='pycodestyle',
-            )
+            ),
+            message=text,
+            severity=types.DiagnosticSeverity.Warning,
+            code=text[:4],
+            source='pycodestyle',
         )
+        for line, offset, text in errors
+    ]
+
+
+class FolderTrie:
+    """Longest prefix lookup of folder uris by path segments."""
+
+    def __init__(self, uris: Iterable[str]):
+        # Nested dicts by segment, folder uri is under None key
+        self._root: Dict[Optional[str], Any] = {}
+        for uri in uris:
+            node = self._root
+            for part in uri.rstrip('/').split('/'):
+                node = node.setdefault(part, {})
+            node[None] = uri
+
+    def find(self, uri: str) -> Optional[str]:
+        node = self._root
+        result = None
+        for part in uri.split('/'):
+            node = node.get(part)
+            if node is None:
+                break
+            result = node.get(None, result)
+        return result
 
 
 def _get_workspace_folder_path(ls: LanguageServer, uri: str) -> str:
     # find workspace folder uri belongs to
-    folders = sorted(
-        (
-            f.uri
-            for f in ls.workspace.folders.values()
-            if uri.startswith(f.uri)
-        ),
-        key=len,
-        reverse=True,
+    global workspaceFolders
+    try:
+        return workspaceFolderPaths[uri]
+    except KeyError:
+        pass
+    if workspaceFolders is None:
+        workspaceFolders = FolderTrie(
+            f.uri for f in ls.workspace.folders.values()
+        )
+    folder = workspaceFolders.find(uri)
+    result = workspaceFolderPaths[uri] = (
+        to_fs_path(folder) if folder else ls.workspace.root_path
     )
-    if folders:
-        return to_fs_path(folders[0])
-    return ls.workspace.root_path
+    return result
 
 
 def get_pycodestyle_options(ls: LanguageServer, uri: str):
+    from . import codestyle
+
     folder = _get_workspace_folder_path(ls, uri)
     result = pycodestyleOptions.get(folder)
     if not result:
-        kwargs = {'config_file': config['pycodestyle_config']}
-        if folder:
-            kwargs['paths'] = [folder]
-        result = CodestyleStyleGuide(**kwargs).options
+        result = codestyle.create_options(folder, config['pycodestyle_config'])
         pycodestyleOptions[folder] = result
     return result
 
 
+def get_yapf_style(ls: LanguageServer, uri: str) -> Tuple[str, int]:
+    from yapf.yapflib import file_resources, style  # type: ignore
+
+    folder = _get_workspace_folder_path(ls, uri)
+    result = yapfStyles.get(folder)
+    if result is None:
+        style_config = config['yapf_style_config']
+        if style_config is None:
+            # As yapf does for the files of the folder
+            style_config = file_resources.GetDefaultStyleForDir(
+                folder or os.curdir
+            )
+        result = yapfStyles[folder] = (
+            style_config,
+            style.CreateStyleFromConfig(style_config)['INDENT_WIDTH'],
+        )
+    return result
+
+
 def get_mypy_config(ls: LanguageServer, uri: str) -> Optional[str]:
     folder = _get_workspace_folder_path(ls, uri)
     if folder in mypyConfigs:
         return mypyConfigs[folder]
-    import os
-
     from mypy.defaults import CONFIG_FILES
 
     result = ''
@@ -304,48 +637,165 @@ def get_mypy_config(ls: LanguageServer, uri: str) -> Optional[str]:
     return result
 
 
+class MypyDaemon:
+    """dmypy process checking files of one workspace folder."""
+
+    def __init__(self, folder: str, args: List[str]):
+        self.folder = folder
+        self.args = args
+        digest = hashlib.sha1(folder.encode()).hexdigest()[:12]
+        self.status_file = os.path.join(
+            tempfile.gettempdir(),
+            f'anakinls-dmypy-{os.getpid()}-{digest}.json',
+        )
+        self.running = False
+        self.failed = False
+        self.files: Set[str] = set()
+        self.lock = threading.RLock()
+
+    def _dmypy(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [
+                sys.executable,
+                '-m',
+                'mypy.dmypy',
+                '--status-file',
+                self.status_file,
+                *args,
+            ],
+            cwd=self.folder or None,
+            capture_output=True,
+            text=True,
+        )
+
+    def _start(self) -> bool:
+        proc = self._dmypy('start', '--', *self.args)
+        if proc.returncode:
+            logging.warning(f'Failed to start dmypy: {proc.stderr.strip()}')
+            self.failed = True
+            return False
+        logging.info(f'dmypy started for {self.folder}')
+        self.running = True
+        self.files.clear()
+        return True
+
+    def check(self, path: str) -> Optional[str]:
+        """Return mypy output or None if the daemon is not available."""
+        with self.lock:
+            if self.failed:
+                return None
+            if not self.running and not self._start():
+                return None
+            if path in self.files:
+                # `--update` is not supported when following imports, so
+                # let the daemon find out which files are changed.
+                proc = self._dmypy('recheck')
+            else:
+                self.files.add(path)
+                proc = self._dmypy('check', *sorted(self.files))
+            # 0 - no errors, 1 - errors found, 2 - something went wrong
+            if proc.returncode > 1:
+                logging.warning(f'dmypy check failed: {proc.stderr.strip()}')
+                self.stop()
+                self.failed = True
+                return None
+            return proc.stdout
+
+    def stop(self):
+        with self.lock:
+            if self.running:
+                self._dmypy('stop')
+                self.running = False
+
+
+class MypyDaemons:
+    """Daemons keyed by workspace folder, same as `get_mypy_config`."""
+
+    def __init__(self):
+        self._daemons: Dict[str, MypyDaemon] = {}
+        self._lock = threading.Lock()
+
+    def check(self, folder: str, args: List[str], path: str) -> Optional[str]:
+        with self._lock:
+            daemon = self._daemons.get(folder)
+            if daemon is not None and daemon.args != args:
+                daemon.stop()
+                daemon = None
+            if daemon is None:
+                daemon = self._daemons[folder] = MypyDaemon(folder, args)
+        return daemon.check(path)
+
+    def stop(self):
+        with self._lock:
+            for daemon in self._daemons.values():
+                daemon.stop()
+            self._daemons.clear()
+
+
+mypyDaemons = MypyDaemons()
+atexit.register(mypyDaemons.stop)
+
+
 def _mypy_check(
     ls: LanguageServer,
     uri: str,
     script: Script,
     result: List[types.Diagnostic],
 ):
-    from mypy import api
-
     assert jediEnvironment is not None
     version_info = jediEnvironment.version_info
-    if config['diagnostic_on_change']:
-        args = ['--command', script._code]
-    else:
-        args = [to_fs_path(uri)]
-    lines = api.run(
-        [
-            '--python-executable',
-            jediEnvironment.executable,
-            '--python-version',
-            f'{version_info.major}.{version_info.minor}',
-            '--config-file',
-            get_mypy_config(ls, uri),
-            '--hide-error-context',
-            '--show-column-numbers',
-            '--show-error-codes',
-            '--no-pretty',
-            '--no-error-summary',
-        ]
-        + args
-    )
-    if lines[1]:
-        ls.show_message(lines[1], types.MessageType.Error)
-        return
+    args = [
+        '--python-executable',
+        jediEnvironment.executable,
+        '--python-version',
+        f'{version_info.major}.{version_info.minor}',
+        '--config-file',
+        get_mypy_config(ls, uri),
+        '--hide-error-context',
+        '--show-column-numbers',
+        '--show-error-codes',
+        '--show-absolute-path',
+        '--no-pretty',
+        '--no-error-summary',
+    ]
+    path = to_fs_path(uri)
+    output = None
+    if config['mypy_daemon'] and not config['diagnostic_on_change']:
+        # Daemon checks files on disk only
+        output = mypyDaemons.check(
+            _get_workspace_folder_path(ls, uri), args, path
+        )
+    if output is None:
+        from mypy import api
 
-    for line in lines[0].split('\n'):
-        parts = line.split(':', 4)
-        if len(parts) < 5:
+        if config['diagnostic_on_change']:
+            args += ['--command', script._code]
+        else:
+            args.append(path)
+        lines = api.run(args)
+        if lines[1]:
+            # Diagnostics run in worker threads
+            ls.loop.call_soon_threadsafe(
+                ls.show_message, lines[1], types.MessageType.Error
+            )
+            return
+        output = lines[0]
+
+    checked = os.path.normcase(os.path.abspath(path)) if path else None
+    for line in output.splitlines():
+        match = RE_MYPY_LINE.match(line)
+        if not match:
+            continue
+        fn, row, column, err_type, message = match.groups()
+        if (
+            not config['diagnostic_on_change']
+            and os.path.normcase(os.path.abspath(fn)) != checked
+        ):
+            # Daemon reports errors of all the checked files
             continue
-        _fn, row, column, err_type, message = parts
         row = int(row) - 1
         column = int(column) - 1
-        if err_type.strip() == 'note':
+        if err_type == 'note':
             severity = types.DiagnosticSeverity.Hint
         else:
             severity = types.DiagnosticSeverity.Warning
@@ -365,75 +815,396 @@ def _mypy_check(
     return result
 
 
-def _validate(ls: LanguageServer, uri: str, script: Script = None):
-    if script is None:
-        script = get_script(ls, uri)
+def _get_hash(code: str) -> str:
+    return hashlib.sha1(code.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def _cached_diagnostics(
+    key: Tuple, check: Callable[[], List[types.Diagnostic]]
+) -> List[types.Diagnostic]:
+    # Checker results don't change until the content or the checker
+    # configuration, which are parts of the key, is changed
+    result = diagnosticsCache.get(key)
+    if result is None:
+        result = diagnosticsCache[key] = check()
+    return list(result)
+
+
+def _pyflakes_key(uri: str, digest: str) -> Tuple:
+    return ('pyflakes', uri, digest, tuple(config['pyflakes_errors']))
+
+
+def _pycodestyle_key(ls: LanguageServer, uri: str, digest: str) -> Tuple:
+    # Options are read from configuration files of the workspace folder
+    return (
+        'pycodestyle',
+        uri,
+        digest,
+        _get_workspace_folder_path(ls, uri),
+        config['pycodestyle_config'],
+    )
+
+
+def _get_diagnostics(
+    ls: LanguageServer,
+    uri: str,
+    script: Script,
+    is_current: Optional[Callable[[], bool]] = None,
+) -> Optional[List[types.Diagnostic]]:
+    digest = _get_hash(script._code)
 
     # Jedi
-    result = [
-        types.Diagnostic(
-            range=types.Range(
-                start=types.Position(line=x.line - 1, character=x.column),
-                end=types.Position(
-                    line=x.until_line - 1, character=x.until_column
+    def _jedi():
+        with stats.timer('diagnostics/jedi'):
+            syntax_errors = jediExecutor.submit(
+                script.get_syntax_errors
+            ).result()
+        return [
+            types.Diagnostic(
+                range=types.Range(
+                    start=types.Position(line=x.line - 1, character=x.column),
+                    end=types.Position(
+                        line=x.until_line - 1, character=x.until_column
+                    ),
                 ),
-            ),
-            message=x.get_message(),
-            severity=types.DiagnosticSeverity.Error,
-            source='jedi',
-        )
-        for x in script.get_syntax_errors()
-    ]
+                message=x.get_message(),
+                severity=types.DiagnosticSeverity.Error,
+                source='jedi',
+            )
+            for x in syntax_errors
+        ]
+
+    result = _cached_diagnostics(('jedi', uri, digest), _jedi)
 
     # pyflakes
-    pyflakes_check(
-        script._code,
-        script.path,
-        PyflakesReporter(result, script, config['pyflakes_errors']),
-    )
+    def _pyflakes():
+        from pyflakes.api import check as pyflakes_check  # type: ignore
+
+        pyflakes_result: List[types.Diagnostic] = []
+        with stats.timer('diagnostics/pyflakes'):
+            pyflakes_check(
+                script._code,
+                script.path,
+                PyflakesReporter(
+                    pyflakes_result,
+                    script._code_lines,
+                    config['pyflakes_errors'],
+                ),
+            )
+        return pyflakes_result
+
+    result.extend(_cached_diagnostics(_pyflakes_key(uri, digest), _pyflakes))
+    if is_current and not is_current():
+        return None
 
     # pycodestyle
     codestyleopts = get_pycodestyle_options(ls, uri)
-    CodestyleChecker(
-        script.path,
-        script._code.replace('\r\n', '\n')
-        .replace('\r', '\n')
-        .splitlines(True),
-        codestyleopts,
-        CodestyleReport(codestyleopts, result),
-    ).check_all()
+
+    def _pycodestyle():
+        with stats.timer('diagnostics/pycodestyle'):
+            return _check_codestyle(
+                uri, script.path, script._code, codestyleopts
+            )
+
+    result.extend(
+        _cached_diagnostics(_pycodestyle_key(ls, uri, digest), _pycodestyle)
+    )
 
     # mypy
     if config['mypy_enabled']:
+        if is_current and not is_current():
+            return None
+
+        def _mypy():
+            mypy_result: List[types.Diagnostic] = []
+            with stats.timer('diagnostics/mypy'):
+                _mypy_check(ls, uri, script, mypy_result)
+            return mypy_result
+
         try:
-            _mypy_check(ls, uri, script, result)
+            key = (
+                'mypy',
+                uri,
+                digest,
+                get_mypy_config(ls, uri),
+                config['mypy_daemon'],
+                config['diagnostic_on_change'],
+                mypyGeneration,
+            )
+            result.extend(_cached_diagnostics(key, _mypy))
         except Exception as e:
-            ls.show_message(
-                f'mypy check error: {e}', types.MessageType.Warning
+            ls.loop.call_soon_threadsafe(
+                ls.show_message,
+                f'mypy check error: {e}',
+                types.MessageType.Warning,
+            )
+
+    return result
+
+
+# pycodestyle options of the worker process by workspace folder and
+# configuration file
+processCodestyleOptions: Dict[Tuple[str, Optional[str]], Any] = {}
+
+
+def _check_in_process(
+    path: Optional[str],
+    code: str,
+    pyflakes_errors: List[str],
+    folder: str,
+    config_file: Optional[str],
+) -> Tuple[List[types.Diagnostic], 'CodestyleResult']:
+    # Runs in `processPool`. Jedi syntax errors and mypy are left to the
+    # diagnostics threads, as Jedi state can't be shared between
+    # processes.
+    from pyflakes.api import check as pyflakes_check  # type: ignore
+
+    from . import codestyle
+
+    pyflakes_result: List[types.Diagnostic] = []
+    pyflakes_check(
+        code,
+        path,
+        PyflakesReporter(
+            pyflakes_result, split_lines(code, keepends=True), pyflakes_errors
+        ),
+    )
+    key = (folder, config_file)
+    options = processCodestyleOptions.get(key)
+    if options is None:
+        options = processCodestyleOptions[key] = codestyle.create_options(
+            folder, config_file
+        )
+    result = codestyle.check(None, path, codestyle.get_lines(code), options)
+    # Options can't be pickled
+    return pyflakes_result, result._replace(options=None)
+
+
+class DiagnosticsScheduler:
+    """Run validation off the event loop.
+
+    Every scheduled run gets a new generation number, the last one is
+    remembered per document. Runs superseded by a newer one are skipped if they haven't started yet,
+    stopped between checkers otherwise, and their results are never
+    published.
+
+    Bursts of changes are coalesced with `debounce`.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='anakinls-diagnostics'
+        )
+        self._generations: Dict[str, int] = {}
+        # Not per document: runs of the closed document must not match
+        # runs after it is opened again
+        self._last_generation = 0
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._first_change: Dict[str, float] = {}
+
+    def _is_current(self, uri: str, generation: int) -> bool:
+        return self._generations.get(uri) == generation
+
+    def schedule(self, ls: LanguageServer, uri: str):
+        # Capture the document in the loop thread so the run checks the
+        # document as it is now.
+        document = ls.workspace.get_text_document(uri)
+        self._last_generation += 1
+        generation = self._generations[uri] = self._last_generation
+        self._executor.submit(
+            self._run,
+            ls,
+            uri,
+            document.source,
+            document.path,
+            document.version,
+            generation,
+        )
+
+    def schedule_all(self, ls: LanguageServer, uris: List[str]):
+        """Validate documents, the most recently used ones first.
+
+        pyflakes and pycodestyle checks which are not cached run in
+        `processPool`, `diagnostic_processes` documents at once. Every
+        document is published as soon as its checks are done.
+        """
+        rank = {uri: i for i, uri in enumerate(recentDocuments)}
+        uris = sorted(uris, key=lambda uri: rank.get(uri, -1), reverse=True)
+        if config['diagnostic_processes'] <= 0 or len(uris) < 2:
+            for uri in uris:
+                self.schedule(ls, uri)
+            return
+        for uri in uris:
+            document = ls.workspace.get_text_document(uri)
+            code = document.source
+            digest = _get_hash(code)
+            pyflakes_key = _pyflakes_key(uri, digest)
+            pycodestyle_key = _pycodestyle_key(ls, uri, digest)
+            if (
+                diagnosticsCache.get(pyflakes_key) is not None
+                and diagnosticsCache.get(pycodestyle_key) is not None
+            ):
+                self.schedule(ls, uri)
+                continue
+            future = _get_process_pool().submit(
+                _check_in_process,
+                document.path,
+                code,
+                list(config['pyflakes_errors']),
+                pycodestyle_key[3],
+                pycodestyle_key[4],
+            )
+            future.add_done_callback(
+                partial(
+                    self._checked_in_process,
+                    ls,
+                    uri,
+                    pyflakes_key,
+                    pycodestyle_key,
+                )
             )
 
-    ls.publish_diagnostics(uri, result)
+    def _checked_in_process(self, ls: LanguageServer, *args):
+        # Called in a thread of the process pool
+        ls.loop.call_soon_threadsafe(self._store_checked, ls, *args)
+
+    def _store_checked(
+        self,
+        ls: LanguageServer,
+        uri: str,
+        pyflakes_key: Tuple,
+        pycodestyle_key: Tuple,
+        future: Future,
+    ):
+        if future.cancelled():
+            return
+        try:
+            pyflakes_result, codestyle_result = future.result()
+        except BrokenProcessPool:
+            logging.exception('Diagnostics process pool is broken')
+            _shutdown_process_pool()
+        except Exception:
+            logging.exception(f'Validation of {uri} failed')
+        else:
+            diagnosticsCache[pyflakes_key] = pyflakes_result
+            diagnosticsCache[pycodestyle_key] = _codestyle_diagnostics(
+                codestyle_result.lines, codestyle_result.errors
+            )
+            if pycodestyle_key == _pycodestyle_key(
+                ls, uri, pycodestyle_key[2]
+            ):
+                # Following changes of the document are checked
+                # incrementally
+                codestyleResults[uri] = codestyle_result._replace(
+                    options=get_pycodestyle_options(ls, uri)
+                )
+        # Jedi and mypy checks run as usual, the rest are cached now
+        if uri in ls.workspace.text_documents:
+            self.schedule(ls, uri)
+
+    def debounce(self, ls: LanguageServer, uri: str):
+        # Wait for `diagnostic_debounce` ms of quiet, but no more than
+        # `diagnostic_max_wait` ms since the first change of the burst.
+        delay = config['diagnostic_debounce'] / 1000
+        if delay <= 0:
+            self.schedule(ls, uri)
+            return
+        now = ls.loop.time()
+        first = self._first_change.setdefault(uri, now)
+        max_wait = config['diagnostic_max_wait'] / 1000
+        if max_wait > 0:
+            delay = max(min(delay, first + max_wait - now), 0)
+        timer = self._timers.pop(uri, None)
+        if timer:
+            timer.cancel()
+        self._timers[uri] = ls.loop.call_later(delay, self._fire, ls, uri)
+
+    def _fire(self, ls: LanguageServer, uri: str):
+        del self._timers[uri]
+        del self._first_change[uri]
+        self.schedule(ls, uri)
+
+    def cancel(self, uri: str):
+        self._generations.pop(uri, None)
+        self._first_change.pop(uri, None)
+        timer = self._timers.pop(uri, None)
+        if timer:
+            timer.cancel()
+
+    def _run(
+        self,
+        ls: LanguageServer,
+        uri: str,
+        code: str,
+        path: Optional[str],
+        version: Optional[int],
+        generation: int,
+    ):
+        if not self._is_current(uri, generation):
+            return
+        try:
+            script = jediExecutor.submit(
+                _get_script, uri, code, path, version
+            ).result()
+            result = _get_diagnostics(
+                ls, uri, script, lambda: self._is_current(uri, generation)
+            )
+        except Exception:
+            logging.exception(f'Validation of {uri} failed')
+            return
+        if result is not None:
+            ls.loop.call_soon_threadsafe(
+                self._publish, ls, uri, result, version, generation
+            )
+
+    def _publish(
+        self,
+        ls: LanguageServer,
+        uri: str,
+        result: List[types.Diagnostic],
+        version: Optional[int],
+        generation: int,
+    ):
+        if self._is_current(uri, generation):
+            ls.publish_diagnostics(uri, result, version)
+
+
+diagnostics = DiagnosticsScheduler()
 
 
 @server.feature(types.TEXT_DOCUMENT_DID_OPEN)
 def did_open(ls: LanguageServer, params: types.DidOpenTextDocumentParams):
+    savedHashes[params.text_document.uri] = _get_hash(
+        params.text_document.text
+    )
     if config['diagnostic_on_open']:
-        _validate(ls, params.text_document.uri)
+        diagnostics.schedule(ls, params.text_document.uri)
+    if config['prefetch_depth'] and jediProject is not None:
+        prefetchTasks[params.text_document.uri] = ls.loop.create_task(
+            _prefetch(ls, params.text_document.uri)
+        )
 
 
 @server.feature(types.TEXT_DOCUMENT_DID_CLOSE)
 def did_close(ls: LanguageServer, params: types.DidCloseTextDocumentParams):
-    try:
-        del scripts[params.text_document.uri]
-    except KeyError:
-        pass
+    diagnostics.cancel(params.text_document.uri)
+    scripts.pop(params.text_document.uri)
+    codestyleResults.pop(params.text_document.uri)
+    savedHashes.pop(params.text_document.uri, None)
+    recentDocuments.pop(params.text_document.uri, None)
+    positionResults.pop(params.text_document.uri, None)
+    workspaceFolderPaths.pop(params.text_document.uri, None)
+    task = prefetchTasks.pop(params.text_document.uri, None)
+    if task is not None:
+        task.cancel()
 
 
 @server.feature(types.TEXT_DOCUMENT_DID_CHANGE)
 def did_change(ls: LanguageServer, params: types.DidChangeTextDocumentParams):
-    script = get_script(ls, params.text_document.uri, True)
+    # Script is rebuilt by the next request that needs it
+    positionResults.pop(params.text_document.uri, None)
     if config['diagnostic_on_change']:
-        _validate(ls, params.text_document.uri, script)
+        diagnostics.debounce(ls, params.text_document.uri)
 
 
 def _completion_sort_key(completion: Completion, prefix: str = '') -> str:
@@ -445,7 +1216,9 @@ def _completion_sort_key(completion: Completion, prefix: str = '') -> str:
     return f'aa{prefix}{name}'
 
 
-def _completion_item(completion: Completion, r: types.Range) -> Dict:
+def _completion_item(
+    completion: Completion, r: types.Range, request: int, index: int
+) -> Dict:
     label = completion.name
     _r = r
     lnm = completion._like_name_length
@@ -464,28 +1237,29 @@ def _completion_item(completion: Completion, r: types.Range) -> Dict:
         kind=_COMPLETION_TYPES.get(
             completion.type, types.CompletionItemKind.Text
         ),
-        documentation=completion.docstring(raw=True),
         text_edit=types.TextEdit(range=_r, new_text=label),
+        # Documentation is provided by `completionItem/resolve`
+        data={'request': request, 'index': index},
     )
 
 
 def _completions(
-    completions: List[Completion], r: types.Range
+    completions: List[Completion], r: types.Range, request: int
 ) -> Iterator[types.CompletionItem]:
     return (
         types.CompletionItem(
             sort_text=_completion_sort_key(completion),
-            **_completion_item(completion, r),
+            **_completion_item(completion, r, request, i),
         )
-        for completion in completions
+        for i, completion in enumerate(completions)
     )
 
 
 def _completions_snippets(
-    completions: List[Completion], r: types.Range
+    completions: List[Completion], r: types.Range, request: int
 ) -> Iterator[types.CompletionItem]:
-    for completion in completions:
-        item = _completion_item(completion, r)
+    for i, completion in enumerate(completions):
+        item = _completion_item(completion, r, request, i)
         yield types.CompletionItem(
             sort_text=_completion_sort_key(completion, completionPrefixPlain),
             **item,
@@ -495,7 +1269,7 @@ def _completions_snippets(
         for signature in completion.get_signatures():
             names = []
             snippets = []
-            for i, param in enumerate(signature.params):
+            for param_index, param in enumerate(signature.params):
                 if param.kind == Parameter.VAR_KEYWORD:
                     break
                 if '=' in param.description:
@@ -507,7 +1281,9 @@ def _completions_snippets(
                     snippet_prefix = f'{param.name}='
                 else:
                     snippet_prefix = ''
-                snippets.append(f'{snippet_prefix}${{{i + 1}:{param.name}}}')
+                snippets.append(
+                    f'{snippet_prefix}${{{param_index + 1}:{param.name}}}'
+                )
             names_str = ', '.join(names)
             snippets_str = ', '.join(snippets)
             yield types.CompletionItem(
@@ -526,16 +1302,25 @@ def _completions_snippets(
 
 @server.feature(
     types.TEXT_DOCUMENT_COMPLETION,
-    types.CompletionOptions(trigger_characters=['.']),
+    types.CompletionOptions(trigger_characters=['.'], resolve_provider=True),
 )
-def completions(ls: LanguageServer, params: types.CompletionParams):
+async def completions(ls: LanguageServer, params: types.CompletionParams):
     global completionFunction
-    script = get_script(ls, params.text_document.uri)
-    completions = script.complete(
+    global completionRequest
+    global lastCompletions
+    script = await get_script_async(ls, params.text_document.uri)
+    completions = await _run_jedi(
+        script.complete,
         params.position.line + 1,
         params.position.character,
         fuzzy=config['completion_fuzzy'],
     )
+    completionRequest += 1
+    lastCompletions = completions
+    # The items are built later in the Jedi thread, when the globals may
+    # be changed by the next request
+    request = completionRequest
+    function = completionFunction
     code_line = script._code_lines[params.position.line]
     word_match = RE_WORD.match(code_line[params.position.character :])
     if word_match:
@@ -551,9 +1336,24 @@ def completions(ls: LanguageServer, params: types.CompletionParams):
             character=params.position.character + word_rest,
         ),
     )
-    return types.CompletionList(
-        is_incomplete=False, items=list(completionFunction(completions, r))
-    )
+    items = await _run_jedi(lambda: list(function(completions, r, request)))
+    return types.CompletionList(is_incomplete=False, items=items)
+
+
+@server.feature(types.COMPLETION_ITEM_RESOLVE)
+async def completion_item_resolve(
+    ls: LanguageServer, item: types.CompletionItem
+) -> types.CompletionItem:
+    data = item.data
+    if (
+        isinstance(data, dict)
+        and data.get('request') == completionRequest
+        and 0 <= data.get('index', -1) < len(lastCompletions)
+    ):
+        item.documentation = await _run_jedi(
+            lastCompletions[data['index']].docstring, raw=True
+        )
+    return item
 
 
 def _docstring(name: Name) -> str:
@@ -577,63 +1377,114 @@ def _docstring_markdown(name: Name) -> str:
     return f'```\n{doc}\n```'
 
 
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == '_'
+
+
+def _position_results(
+    ls: LanguageServer, params: types.TextDocumentPositionParams, kind: str
+) -> Tuple[Dict[Tuple, Any], Tuple]:
+    """Memo of the document results and the key of the position.
+
+    Positions on the same identifier have the same key, so moving the
+    cursor along the name doesn't run Jedi again.
+    """
+    uri = params.text_document.uri
+    document = ls.workspace.get_text_document(uri)
+    memo = positionResults.get(uri)
+    if memo is None or memo[0] != document.version:
+        memo = positionResults[uri] = (document.version, {})
+    line = params.position.line
+    column = params.position.character
+    lines = document.lines
+    if line < len(lines) and _is_word_char(lines[line][column : column + 1]):
+        text = lines[line]
+        while column > 0 and _is_word_char(text[column - 1]):
+            column -= 1
+    return memo[1], (kind, line, column)
+
+
+def _store_position_result(memo: Dict[Tuple, Any], key: Tuple, result: Any):
+    if len(memo) >= MAX_POSITION_RESULTS:
+        del memo[next(iter(memo))]
+    memo[key] = result
+
+
 @server.feature(types.TEXT_DOCUMENT_HOVER)
-def hover(
+async def hover(
     ls: LanguageServer, params: types.TextDocumentPositionParams
 ) -> Optional[types.Hover]:
     global hoverFunction
     global jediHoverFunction
-    script = get_script(ls, params.text_document.uri)
-    names = jediHoverFunction(
-        script, params.position.line + 1, params.position.character
-    )
-    result = '\n\n'.join(map(hoverFunction, names))
-    if result:
-        return types.Hover(
-            contents=types.MarkupContent(kind=hoverMarkup, value=result)
+    memo, key = _position_results(ls, params, hoverMarkup)
+    if key in memo:
+        return memo[key]
+    script = await get_script_async(ls, params.text_document.uri)
+
+    def _hover():
+        names = jediHoverFunction(
+            script, params.position.line + 1, params.position.character
         )
-    return None
+        return '\n\n'.join(map(hoverFunction, names))
+
+    value = await _run_jedi(_hover)
+    result = None
+    if value:
+        result = types.Hover(
+            contents=types.MarkupContent(kind=hoverMarkup, value=value)
+        )
+    _store_position_result(memo, key, result)
+    return result
 
 
 @server.feature(
     types.TEXT_DOCUMENT_SIGNATURE_HELP,
     types.SignatureHelpOptions(trigger_characters=['(', ',']),
 )
-def signature_help(
+async def signature_help(
     ls: LanguageServer, params: types.TextDocumentPositionParams
 ) -> Optional[types.SignatureHelp]:
-    script = get_script(ls, params.text_document.uri)
-    signatures = script.get_signatures(
-        params.position.line + 1, params.position.character
-    )
-
-    result = []
-    idx = -1
-    param_idx = -1
-    i = 0
-    for signature in signatures:
-        if signature.index is None:
-            continue
-        result.append(
-            types.SignatureInformation(
-                label=signature.to_string(),
-                parameters=[
-                    types.ParameterInformation(label=param.name)
-                    for param in signature.params
-                ],
-            )
-        )
-        if signature.index > param_idx:
-            param_idx = signature.index
-            idx = i
-        i += 1
-    if result:
-        return types.SignatureHelp(
-            signatures=[result[idx]],
-            active_signature=0,
-            active_parameter=param_idx,
+    memo, key = _position_results(ls, params, 'signature')
+    if key in memo:
+        return memo[key]
+    script = await get_script_async(ls, params.text_document.uri)
+
+    def _signature_help():
+        signatures = script.get_signatures(
+            params.position.line + 1, params.position.character
         )
-    return None
+
+        result = []
+        idx = -1
+        param_idx = -1
+        i = 0
+        for signature in signatures:
+            if signature.index is None:
+                continue
+            result.append(
+                types.SignatureInformation(
+                    label=signature.to_string(),
+                    parameters=[
+                        types.ParameterInformation(label=param.name)
+                        for param in signature.params
+                    ],
+                )
+            )
+            if signature.index > param_idx:
+                param_idx = signature.index
+                idx = i
+            i += 1
+        if result:
+            return types.SignatureHelp(
+                signatures=[result[idx]],
+                active_signature=0,
+                active_parameter=param_idx,
+            )
+        return None
+
+    result = await _run_jedi(_signature_help)
+    _store_position_result(memo, key, result)
+    return result
 
 
 def _get_name_range(name: Name) -> types.Range:
@@ -656,23 +1507,98 @@ def _get_locations(defs: List[Name]) -> List[types.Location]:
 
 
 @server.feature(types.TEXT_DOCUMENT_DEFINITION)
-def definition(
+async def definition(
     ls: LanguageServer, params: types.TextDocumentPositionParams
 ) -> List[types.Location]:
-    script = get_script(ls, params.text_document.uri)
-    defs = script.goto(params.position.line + 1, params.position.character)
+    script = await get_script_async(ls, params.text_document.uri)
+    defs = await _run_jedi(
+        script.goto, params.position.line + 1, params.position.character
+    )
     return _get_locations(defs)
 
 
 @server.feature(types.TEXT_DOCUMENT_REFERENCES)
-def references(
+async def references(
     ls: LanguageServer, params: types.ReferenceParams
 ) -> List[types.Location]:
-    script = get_script(ls, params.text_document.uri)
-    refs = script.get_references(
-        params.position.line + 1, params.position.character
+    # References are searched file by file. With partial result token
+    # locations of each file are sent as soon as the file is searched,
+    # and the number of parsed files is not limited.
+    token = params.partial_result_token
+    result: List[types.Location] = []
+
+    def _report(names: List[Name]):
+        locations = _get_locations(names)
+        if not locations:
+            return
+        if token is None:
+            result.extend(locations)
+        else:
+            ls.send_notification(
+                types.PROGRESS,
+                types.ProgressParams(token=token, value=locations),
+            )
+
+    script = await get_script_async(ls, params.text_document.uri)
+    search = ReferenceSearch(
+        script, params.position.line + 1, params.position.character
     )
-    return _get_locations(refs)
+    _report(await _run_jedi(search.start))
+    if not search.project_wide or jediProject is None:
+        return result
+    documents = ls.workspace.text_documents
+    sources = {
+        document.path: document.source
+        for document in documents.values()
+        if document.path
+    }
+    # Pre-filter files by the name text before any inference
+    candidates = await asyncio.get_running_loop().run_in_executor(
+        None, search.find_candidates, [str(jediProject.path)], sources
+    )
+    # Open documents first, the most recently used first
+    rank = {
+        documents[uri].path: -i
+        for i, uri in enumerate(recentDocuments)
+        if uri in documents
+    }
+    candidates.sort(key=lambda path: rank.get(path, 1))
+    if token is None:
+        del candidates[MAX_REFERENCES_PARSED_FILES:]
+    for path in candidates:
+        _report(await _run_jedi(search.search_file, path, sources.get(path)))
+    return result
+
+
+def _log_stats(ls: LanguageServer):
+    global statsLogHandle
+    statsLogHandle = None
+    summary = stats.format()
+    if summary:
+        logging.info(f'Stats: {summary}')
+    logging.info(f'Scripts cache: {scripts.format_stats()}')
+    _schedule_stats_log(ls)
+
+
+def _schedule_stats_log(ls: LanguageServer):
+    global statsLogHandle
+    if statsLogHandle is not None:
+        statsLogHandle.cancel()
+        statsLogHandle = None
+    if config['stats_log_interval']:
+        statsLogHandle = ls.loop.call_later(
+            config['stats_log_interval'], _log_stats, ls
+        )
+
+
+@server.feature('$/anakinls/stats')
+def get_stats(ls: LanguageServer, params) -> Dict[str, Dict[str, Any]]:
+    result: Dict[str, Dict[str, Any]] = dict(stats.summary())
+    result['cache/scripts'] = scripts.stats()
+    if getattr(params, 'reset', False):
+        stats.clear()
+        scripts.clear_stats()
+    return result
 
 
 @server.feature(types.WORKSPACE_DID_CHANGE_CONFIGURATION)
@@ -689,6 +1615,7 @@ def did_change_configuration(
         config[k] = v = conf[k]
         if k == 'help_on_hover':
             global jediHoverFunction
+            positionResults.clear()
             if v:
                 jediHoverFunction = Script.help
             else:
@@ -702,6 +1629,18 @@ def did_change_configuration(
             else:
                 completionPrefixPlain = 'a'
                 completionPrefixSnippet = 'z'
+        elif k in ('diagnostic_debounce', 'diagnostic_max_wait'):
+            pass
+        elif k == 'stats_log_interval':
+            _schedule_stats_log(ls)
+        elif k == 'diagnostic_processes':
+            _shutdown_process_pool()
+        elif k == 'yapf_style_config':
+            yapfStyles.clear()
+        elif k == 'format_on_save':
+            pass
+        elif k in ('script_cache_max_entries', 'script_cache_max_size'):
+            _resize_scripts()
         else:
             changed.add(k)
     if 'jedi_settings' in conf:
@@ -712,9 +1651,329 @@ def did_change_configuration(
         pycodestyleOptions.clear()
     if 'mypy_enabled' in changed:
         mypyConfigs.clear()
+    if changed & {'mypy_enabled', 'mypy_daemon'}:
+        mypyDaemons.stop()
     if changed and config['diagnostic_on_open']:
-        for uri in ls.workspace.documents:
-            _validate(ls, uri)
+        diagnostics.schedule_all(ls, list(ls.workspace.text_documents))
+
+
+def _index_symbols(index: SymbolIndex, roots: List[str]):
+    try:
+        index.scan(roots, symbolIndexStop.is_set)
+    except Exception:
+        logging.exception('Failed to index workspace symbols')
+
+
+async def _wait_jedi_idle():
+    while not jediExecutor.is_idle():
+        await asyncio.sleep(WARM_UP_WAIT)
+
+
+def _warm_up_module(module: str):
+    with stats.timer('warm_up'):
+        Script(
+            f'import {module}\n{module}.',
+            project=jediProject,
+            environment=jediEnvironment,
+        ).complete(2, len(module) + 1)
+
+
+async def _warm_up(ls: LanguageServer):
+    roots = [str(jediProject.path)] + [
+        str(p) for p in jediProject.added_sys_path
+    ]
+    if warmUp is True:
+        modules = await ls.loop.run_in_executor(
+            None, get_most_imported, roots, MAX_WARM_UP_MODULES
+        )
+    else:
+        modules = list(warmUp)
+    if not modules:
+        return
+    token = 'anakinls-warm-up'
+    progress = bool(
+        getattr(
+            getattr(ls.client_capabilities, 'window', None),
+            'work_done_progress',
+            False,
+        )
+    )
+    if progress:
+        try:
+            await ls.progress.create_async(token)
+        except Exception:
+            logging.exception('Failed to create warm-up progress')
+            progress = False
+    if progress:
+        ls.progress.begin(
+            token,
+            types.WorkDoneProgressBegin(title='Warming up Jedi', percentage=0),
+        )
+    start = time.perf_counter()
+    try:
+        for i, module in enumerate(modules):
+            # Requests go first. Warm-up of a module can't be interrupted,
+            # so start it only when Jedi is idle.
+            await _wait_jedi_idle()
+            if progress:
+                ls.progress.report(
+                    token,
+                    types.WorkDoneProgressReport(
+                        message=module, percentage=i * 100 // len(modules)
+                    ),
+                )
+            try:
+                await _run_jedi(_warm_up_module, module)
+            except Exception:
+                logging.exception(f'Failed to warm up {module}')
+    finally:
+        if progress:
+            ls.progress.end(token, types.WorkDoneProgressEnd())
+    logging.info(
+        f'Warmed up {", ".join(modules)} '
+        f'in {time.perf_counter() - start:.1f}s'
+    )
+
+
+def _prefetch_imports(script: Optional[Script], path: str, limit: int):
+    with stats.timer('prefetch'):
+        if script is None:
+            script = Script(
+                path=path, project=jediProject, environment=jediEnvironment
+            )
+        return get_imported_paths(script, prefetchedPaths, limit)
+
+
+async def _prefetch(ls: LanguageServer, uri: str):
+    # Modules imported by the document and the modules they import, breadth
+    # first. Each module is parsed when its importer's imports are resolved.
+    budget = config['prefetch_max_files']
+    queue: List[Tuple[Optional[str], int]] = [(None, 1)]
+    try:
+        while queue and budget > 0:
+            path, depth = queue.pop(0)
+            await _wait_jedi_idle()
+            script = None
+            if path is None:
+                script = await get_script_async(ls, uri)
+            try:
+                paths = await _run_jedi(
+                    _prefetch_imports, script, path, budget
+                )
+            except Exception:
+                logging.exception(f'Failed to prefetch imports of {path}')
+                continue
+            prefetchedPaths.update(paths)
+            budget -= len(paths)
+            if depth < config['prefetch_depth']:
+                queue.extend((p, depth + 1) for p in paths)
+    finally:
+        if prefetchTasks.get(uri) is asyncio.current_task():
+            del prefetchTasks[uri]
+
+
+def _cache_module(path: str):
+    # Parse the module into the on-disk cache only. It is loaded into
+    # memory when a script needs it.
+    grammar = jediEnvironment.get_grammar()
+    cache_path = Path(jedi_settings.cache_directory)
+    try:
+        if os.path.getmtime(
+            parso.cache._get_hashed_path(grammar._hashed, path, cache_path)
+        ) >= os.path.getmtime(path):
+            return
+    except OSError:
+        pass
+    modules = parso.cache.parser_cache.get(grammar._hashed, {})
+    loaded = Path(path) in modules
+    with stats.timer('cache_prepopulate'):
+        grammar.parse(path=path, cache=True, cache_path=cache_path)
+    if not loaded:
+        parso.cache.parser_cache.get(grammar._hashed, {}).pop(Path(path), None)
+
+
+async def _manage_cache():
+    loop = asyncio.get_running_loop()
+    if cachePrepopulate:
+        start = time.perf_counter()
+        paths = await loop.run_in_executor(
+            None, lambda: list(iter_python_files(str(jediProject.path)))
+        )
+        for path in paths:
+            # Parsing runs in the Jedi thread to not race with scripts
+            # using the same cache, when there are no requests.
+            await _wait_jedi_idle()
+            try:
+                await _run_jedi(_cache_module, path)
+            except Exception:
+                logging.exception(f'Failed to cache {path}')
+        logging.info(
+            f'Cached {len(paths)} files '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
+    if cacheMaxSize:
+        removed = await loop.run_in_executor(
+            None,
+            prune_directory,
+            jedi_settings.cache_directory,
+            cacheMaxSize * 1024 * 1024,
+        )
+        if removed:
+            logging.info(f'Removed {removed} files from Jedi cache')
+
+
+def _start_symbol_index() -> bool:
+    global symbolIndex
+    project_path = str(jediProject.path)
+    digest = hashlib.sha1(project_path.encode()).hexdigest()[:12]
+    try:
+        symbolIndex = SymbolIndex(
+            os.path.join(get_cache_directory(), f'symbols-{digest}.db')
+        )
+    except Exception:
+        logging.exception('Failed to open workspace symbols index')
+        return False
+    roots = [project_path] + [str(p) for p in jediProject.added_sys_path]
+    threading.Thread(
+        target=_index_symbols,
+        args=(symbolIndex, roots),
+        name='anakinls-symbols',
+        daemon=True,
+    ).start()
+    return True
+
+
+@server.feature(types.INITIALIZED)
+def initialized(ls: LanguageServer, params: types.InitializedParams):
+    global warmUpTask
+    global cacheTask
+    if jediProject is None:
+        return
+    if warmUp:
+        warmUpTask = ls.loop.create_task(_warm_up(ls))
+    if cachePrepopulate or cacheMaxSize:
+        cacheTask = ls.loop.create_task(_manage_cache())
+    # yapf style files
+    watchers = [
+        types.FileSystemWatcher(
+            glob_pattern=f'**/{{{",".join(YAPF_STYLE_FILES)}}}'
+        )
+    ]
+    if symbolIndexEnabled and _start_symbol_index():
+        watchers.append(types.FileSystemWatcher(glob_pattern='**/*.{py,pyi}'))
+    if getattr(
+        getattr(
+            ls.client_capabilities.workspace, 'did_change_watched_files', None
+        ),
+        'dynamic_registration',
+        False,
+    ):
+        ls.register_capability(
+            types.RegistrationParams(
+                registrations=[
+                    types.Registration(
+                        id='anakinls-watched-files',
+                        method=types.WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                        register_options=(
+                            types.DidChangeWatchedFilesRegistrationOptions(
+                                watchers=watchers
+                            )
+                        ),
+                    )
+                ]
+            )
+        )
+
+
+@server.feature(types.WORKSPACE_DID_CHANGE_WORKSPACE_FOLDERS)
+def did_change_workspace_folders(
+    ls: LanguageServer, params: types.DidChangeWorkspaceFoldersParams
+):
+    global workspaceFolders
+    workspaceFolders = None
+    workspaceFolderPaths.clear()
+
+
+@server.feature(types.WORKSPACE_DID_CHANGE_WATCHED_FILES)
+def did_change_watched_files(
+    ls: LanguageServer, params: types.DidChangeWatchedFilesParams
+):
+    global mypyGeneration
+    mypyGeneration += 1
+    if any(
+        change.uri.rsplit('/', 1)[-1] in YAPF_STYLE_FILES
+        for change in params.changes
+    ):
+        yapfStyles.clear()
+    if symbolIndex is None:
+        return
+    paths = []
+    for change in params.changes:
+        path = to_fs_path(change.uri)
+        if path and path.endswith(('.py', '.pyi')) and path not in paths:
+            paths.append(path)
+    if paths:
+        # Removed files are forgotten too. Checkout may change many files,
+        # so don't parse them in the event loop.
+        asyncio.get_running_loop().run_in_executor(
+            None, symbolIndex.update_many, paths
+        )
+
+
+_WORKSPACE_SYMBOL_KINDS = {
+    'class': types.SymbolKind.Class,
+    'function': types.SymbolKind.Function,
+    'variable': types.SymbolKind.Variable,
+}
+
+
+@server.feature(types.WORKSPACE_SYMBOL)
+async def workspace_symbol(
+    ls: LanguageServer, params: types.WorkspaceSymbolParams
+) -> Optional[List[types.SymbolInformation]]:
+    if symbolIndex is None:
+        return None
+    symbols = await asyncio.get_running_loop().run_in_executor(
+        None, symbolIndex.search, params.query
+    )
+    result = []
+    for symbol in symbols:
+        kind = _WORKSPACE_SYMBOL_KINDS[symbol.kind]
+        if kind == types.SymbolKind.Function and symbol.container:
+            kind = types.SymbolKind.Method
+        result.append(
+            types.SymbolInformation(
+                name=symbol.name,
+                kind=kind,
+                location=types.Location(
+                    uri=from_fs_path(symbol.path),
+                    range=types.Range(
+                        start=types.Position(
+                            line=symbol.line - 1, character=symbol.column
+                        ),
+                        end=types.Position(
+                            line=symbol.line - 1,
+                            character=symbol.column + len(symbol.name),
+                        ),
+                    ),
+                ),
+                container_name=symbol.container,
+            )
+        )
+    return result
+
+
+@server.feature(types.SHUTDOWN)
+def shutdown(ls: LanguageServer, *args):
+    symbolIndexStop.set()
+    if warmUpTask is not None:
+        warmUpTask.cancel()
+    if cacheTask is not None:
+        cacheTask.cancel()
+    for task in prefetchTasks.values():
+        task.cancel()
+    mypyDaemons.stop()
+    _shutdown_process_pool()
 
 
 @server.feature(types.TEXT_DOCUMENT_WILL_SAVE)
@@ -722,12 +1981,33 @@ def will_save(ls: LanguageServer, params: types.WillSaveTextDocumentParams):
     pass
 
 
+@server.feature(types.TEXT_DOCUMENT_WILL_SAVE_WAIT_UNTIL)
+def will_save_wait_until(
+    ls: LanguageServer, params: types.WillSaveTextDocumentParams
+) -> Optional[List[types.TextEdit]]:
+    if not config['format_on_save']:
+        return None
+    return _formatting(ls, params.text_document.uri)
+
+
 @server.feature(
     types.TEXT_DOCUMENT_DID_SAVE, types.SaveOptions(include_text=False)
 )
 def did_save(ls: LanguageServer, params: types.DidSaveTextDocumentParams):
+    global mypyGeneration
+    uri = params.text_document.uri
+    digest = _get_hash(ls.workspace.get_text_document(uri).source)
+    if savedHashes.get(uri) != digest:
+        savedHashes[uri] = digest
+        mypyGeneration += 1
     if config['diagnostic_on_save']:
-        _validate(ls, params.text_document.uri)
+        diagnostics.schedule(ls, params.text_document.uri)
+    if symbolIndex is not None:
+        path = to_fs_path(params.text_document.uri)
+        if path:
+            asyncio.get_running_loop().run_in_executor(
+                None, symbolIndex.update, path
+            )
 
 
 _DOCUMENT_SYMBOL_KINDS = {
@@ -740,35 +2020,56 @@ _DOCUMENT_SYMBOL_KINDS = {
 }
 
 
+def _get_symbol_range(code_lines: List[str], name: Name) -> types.Range:
+    line = name.line - 1
+    return types.Range(
+        start=types.Position(line=line, character=name.column),
+        end=types.Position(line=line, character=len(code_lines[line]) - 1),
+    )
+
+
+def _get_scope_end(name: Name) -> Optional[Tuple[int, int]]:
+    # End of the class or function defined by the name. Imported
+    # classes and functions have the same types but aren't scopes.
+    if name.type not in ('class', 'function'):
+        return None
+    tree_name = name._name.tree_name
+    definition = tree_name and tree_name.get_definition()
+    if definition and definition.type in ('classdef', 'funcdef'):
+        return definition.end_pos
+    return None
+
+
 def _get_document_symbols(
-    code_lines: List[str], names: List[Name], current: Optional[Name] = None
+    code_lines: List[str], names: List[Name]
 ) -> List[types.DocumentSymbol]:
-    # Looks like names are sorted by order of appearance, so
-    # children are after their parents
-    result = []
-    while names:
-        if current and names[0].parent() != current:
-            break
-        name = names.pop(0)
+    # Names are sorted by order of appearance, so the parent of a name
+    # is the innermost definition on the stack which ends after it.
+    result: List[types.DocumentSymbol] = []
+    stack: List[Tuple[Tuple[int, int], types.DocumentSymbol]] = []
+    for name in names:
+        position = (name.line, name.column)
+        while stack and position >= stack[-1][0]:
+            stack.pop()
         if name.type == 'param':
             continue
-        children = _get_document_symbols(code_lines, names, name)
-        line = name.line - 1
-        r = types.Range(
-            start=types.Position(line=line, character=name.column),
-            end=types.Position(line=line, character=len(code_lines[line]) - 1),
-        )
-        result.append(
-            types.DocumentSymbol(
-                name=name.name,
-                kind=_DOCUMENT_SYMBOL_KINDS.get(
-                    name.type, types.SymbolKind.Null
-                ),
-                range=r,
-                selection_range=r,
-                children=children or None,
-            )
+        r = _get_symbol_range(code_lines, name)
+        symbol = types.DocumentSymbol(
+            name=name.name,
+            kind=_DOCUMENT_SYMBOL_KINDS.get(name.type, types.SymbolKind.Null),
+            range=r,
+            selection_range=r,
         )
+        if stack:
+            parent = stack[-1][1]
+            if parent.children is None:
+                parent.children = []
+            parent.children.append(symbol)
+        else:
+            result.append(symbol)
+        end = _get_scope_end(name)
+        if end:
+            stack.append((end, symbol))
     return result
 
 
@@ -781,54 +2082,52 @@ def _document_symbol_hierarchy(
 def _document_symbol_plain(
     uri: str, code_lines: List[str], names: List[Name]
 ) -> List[types.SymbolInformation]:
-    def _symbols():
-        for name in names:
-            if name.type == 'param':
-                continue
-            parent = name.parent()
-            parent_name = parent and parent.full_name
-            if parent_name:
-                module_name = name.module_name
-                if parent_name == module_name:
-                    parent_name = None
-                elif parent_name.startswith(f'{module_name}.'):
-                    parent_name = parent_name[len(module_name) + 1 :]
-            yield types.SymbolInformation(
+    # Same as `_get_document_symbols`, but the stack holds dotted names
+    # of enclosing definitions
+    result = []
+    stack: List[Tuple[Tuple[int, int], str]] = []
+    for name in names:
+        position = (name.line, name.column)
+        while stack and position >= stack[-1][0]:
+            stack.pop()
+        if name.type == 'param':
+            continue
+        container_name = stack[-1][1] if stack else None
+        result.append(
+            types.SymbolInformation(
                 name=name.name,
                 kind=_DOCUMENT_SYMBOL_KINDS.get(
                     name.type, types.SymbolKind.Null
                 ),
                 location=types.Location(
-                    uri=uri,
-                    range=types.Range(
-                        start=types.Position(
-                            line=name.line - 1, character=name.column
-                        ),
-                        end=types.Position(
-                            line=name.line - 1,
-                            characret=len(code_lines[name.line - 1]) - 1,
-                        ),
-                    ),
+                    uri=uri, range=_get_symbol_range(code_lines, name)
                 ),
-                container_name=parent_name,
+                container_name=container_name,
             )
-
-    return list(_symbols())
+        )
+        end = _get_scope_end(name)
+        if end:
+            if container_name:
+                stack.append((end, f'{container_name}.{name.name}'))
+            else:
+                stack.append((end, name.name))
+    return result
 
 
 @server.feature(types.TEXT_DOCUMENT_DOCUMENT_SYMBOL)
-def document_symbol(
+async def document_symbol(
     ls: LanguageServer, params: types.DocumentSymbolParams
 ) -> Union[List[types.DocumentSymbol], List[types.SymbolInformation], None]:
-    script = get_script(ls, params.text_document.uri)
-    names = script.get_names(all_scopes=True)
+    script = await get_script_async(ls, params.text_document.uri)
+    names = await _run_jedi(script.get_names, all_scopes=True)
     if not names:
         return None
     global documentSymbolFunction
-    result = documentSymbolFunction(
+    result = await _run_jedi(
+        documentSymbolFunction,
         params.text_document.uri,
         script._code_lines,
-        script.get_names(all_scopes=True),
+        names,
     )
     return result
 
@@ -879,12 +2178,13 @@ def _get_text_edits(diff: str) -> List[types.TextEdit]:
     return result
 
 
-def _get_document_changes(
+async def _get_document_changes(
     ls: LanguageServer, refactoring: Refactoring
 ) -> List[types.TextDocumentEdit]:
     result = []
-    for fn, changes in refactoring.get_changed_files().items():
-        text_edits = _get_text_edits(changes.get_diff())
+    changed_files = await _run_jedi(refactoring.get_changed_files)
+    for fn, changes in changed_files.items():
+        text_edits = _get_text_edits(await _run_jedi(changes.get_diff))
         if text_edits:
             uri = fn.absolute().as_uri()
             result.append(
@@ -909,17 +2209,19 @@ def _get_document_changes(
         ]
     ),
 )
-def code_action(
+async def code_action(
     ls: LanguageServer, params: types.CodeActionParams
 ) -> Optional[List[types.CodeAction]]:
-    script = get_script(ls, params.text_document.uri)
+    script = await get_script_async(ls, params.text_document.uri)
     try:
-        refactoring = script.inline(
-            params.range.start.line + 1, params.range.start.character
+        refactoring = await _run_jedi(
+            script.inline,
+            params.range.start.line + 1,
+            params.range.start.character,
         )
     except RefactoringError:
         return None
-    document_changes = _get_document_changes(ls, refactoring)
+    document_changes = await _get_document_changes(ls, refactoring)
     if document_changes:
         return [
             types.CodeAction(
@@ -931,20 +2233,96 @@ def code_action(
     return None
 
 
+def _get_line_edits(
+    old: List[str], new: List[str], offset: int = 0
+) -> List[types.TextEdit]:
+    # Edits replacing whole lines. `offset` is the document line of the
+    # first of the lines.
+    start = 0
+    size = min(len(old), len(new))
+    while start < size and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < size - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    matcher = SequenceMatcher(
+        None, old[start : len(old) - end], new[start : len(new) - end], False
+    )
+    offset += start
+    return [
+        types.TextEdit(
+            range=types.Range(
+                start=types.Position(line=offset + i1, character=0),
+                end=types.Position(line=offset + i2, character=0),
+            ),
+            new_text=''.join(new[start + j1 : start + j2]),
+        )
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def _get_statements_lines(
+    code: str, first: int, last: int
+) -> Optional[Tuple[int, int]]:
+    # Zero-based first and last lines of the top level statements
+    # around the lines
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    result = None
+    for node in tree.body:
+        end = node.end_lineno - 1  # type: ignore
+        if end < first:
+            continue
+        start = (
+            min(
+                [node.lineno]
+                + [d.lineno for d in getattr(node, 'decorator_list', ())]
+            )
+            - 1
+        )
+        if start > last:
+            break
+        result = (result[0] if result else start, end)
+    return result
+
+
 def _formatting(
     ls: LanguageServer, uri: str, range_: types.Range = None
 ) -> Optional[List[types.TextEdit]]:
-    old = get_script(ls, uri)._code
-    lines = [(range_.start.line + 1, range_.end.line + 1)] if range_ else None
-    diff, changed = FormatCode(
-        old,
-        style_config=config['yapf_style_config'],
-        lines=lines,
-        print_diff=True,
+    from yapf.yapflib.yapf_api import FormatCode  # type: ignore
+
+    code = ls.workspace.get_text_document(uri).source
+    lines = split_lines(code, keepends=True)
+    first, last = 0, len(lines) - 1
+    yapf_lines = None
+    if range_:
+        # Format only the top level statements around the range
+        span = _get_statements_lines(code, range_.start.line, range_.end.line)
+        if span:
+            first, last = span
+            code = ''.join(lines[first : last + 1])
+        yapf_lines = [
+            (
+                max(range_.start.line - first, 0) + 1,
+                min(range_.end.line, last) - first + 1,
+            )
+        ]
+    new, changed = FormatCode(
+        code, style_config=get_yapf_style(ls, uri)[0], lines=yapf_lines
     )
     if not changed:
         return None
-    return _get_text_edits(diff)
+    return (
+        _get_line_edits(
+            split_lines(code, keepends=True),
+            split_lines(new, keepends=True),
+            first,
+        )
+        or None
+    )
 
 
 @server.feature(types.TEXT_DOCUMENT_FORMATTING)
@@ -961,32 +2339,70 @@ def range_formatting(
     return _formatting(ls, params.text_document.uri, params.range)
 
 
+@server.feature(
+    types.TEXT_DOCUMENT_ON_TYPE_FORMATTING,
+    types.DocumentOnTypeFormattingOptions(
+        first_trigger_character='\n', more_trigger_character=[':']
+    ),
+)
+def on_type_formatting(
+    ls: LanguageServer, params: types.DocumentOnTypeFormattingParams
+) -> Optional[List[types.TextEdit]]:
+    from . import formatting
+
+    # Format the statement just completed by the newline or the
+    # compound statement header
+    line = params.position.line
+    if params.ch == '\n':
+        line -= 1
+    lines = split_lines(
+        ls.workspace.get_text_document(params.text_document.uri).source,
+        keepends=True,
+    )
+    if not 0 <= line < len(lines):
+        return None
+    result = formatting.format_statement(
+        lines,
+        line,
+        *get_yapf_style(ls, params.text_document.uri),
+        header_only=params.ch == ':',
+    )
+    if result is None:
+        return None
+    first, new = result
+    return _get_line_edits(lines[first : line + 1], new, first) or None
+
+
 @server.feature(types.TEXT_DOCUMENT_RENAME)
-def rename(
+async def rename(
     ls: LanguageServer, params: types.RenameParams
 ) -> Optional[types.WorkspaceEdit]:
-    script = get_script(ls, params.text_document.uri)
+    script = await get_script_async(ls, params.text_document.uri)
     try:
-        refactoring = script.rename(
+        refactoring = await _run_jedi(
+            script.rename,
             params.position.line + 1,
             params.position.character,
             new_name=params.new_name,
         )
     except RefactoringError:
         return None
-    document_changes = _get_document_changes(ls, refactoring)
+    document_changes = await _get_document_changes(ls, refactoring)
     if document_changes:
         return types.WorkspaceEdit(document_changes=document_changes)
     return None
 
 
 @server.feature(types.TEXT_DOCUMENT_DOCUMENT_HIGHLIGHT)
-def highlight(
+async def highlight(
     ls: LanguageServer, params: types.TextDocumentPositionParams
 ) -> Optional[List[types.DocumentHighlight]]:
-    script = get_script(ls, params.text_document.uri)
-    names = script.get_references(
-        params.position.line + 1, params.position.character, scope='file'
+    script = await get_script_async(ls, params.text_document.uri)
+    names = await _run_jedi(
+        script.get_references,
+        params.position.line + 1,
+        params.position.character,
+        scope='file',
     )
     if not names:
         return None
@@ -0,0 +1,97 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List
+
+# Number of the latest timings percentiles are computed from
+WINDOW = 1000
+
+
+class Histogram:
+    def __init__(self, window: int = WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._samples.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean and max of all values, percentiles of the latest.
+
+        Values are in milliseconds.
+        """
+        samples = sorted(self._samples)
+        return {
+            'count': self.count,
+            'mean': self.total / self.count * 1000,
+            'p50': _percentile(samples, 50) * 1000,
+            'p95': _percentile(samples, 95) * 1000,
+            'max': self.max * 1000,
+        }
+
+
+def _percentile(samples: List[float], percent: int) -> float:
+    return samples[min(len(samples) * percent // 100, len(samples) - 1)]
+
+
+class Stats:
+    """Timings of requests and diagnostics phases by name."""
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: histogram.summary()
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def format(self) -> str:
+        """One line summary of all timings."""
+        return '; '.join(
+            f'{name} n={s["count"]} p50={s["p50"]:.1f}ms '
+            f'p95={s["p95"]:.1f}ms'
+            for name, s in self.summary().items()
+        )
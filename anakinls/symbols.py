@@ -0,0 +1,357 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ast
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import parso  # type: ignore
+
+SCHEMA_VERSION = 1
+
+# Directories that are never walked
+SKIP_DIRS = {'__pycache__', 'node_modules', 'site-packages'}
+
+RE_DEF_NAME = re.compile(r'(?:async\s+)?(?:def|class)\s+(\w+)')
+
+
+class Symbol(NamedTuple):
+    name: str
+    kind: str  # 'class', 'function' or 'variable'
+    container: Optional[str]
+    path: str
+    line: int  # 1-based, as in parso
+    column: int
+
+
+def _iter_ast_names(
+    lines: List[str], body: List[ast.stmt], container: Optional[str] = None
+) -> Iterator[Tuple]:
+    # Same as `_iter_parso_names`, but uses much faster builtin parser.
+    # Columns are converted from UTF-8 offsets.
+    def _position(lineno, col_offset):
+        line = lines[lineno - 1]
+        if not line.isascii():
+            col_offset = len(line.encode()[:col_offset].decode())
+        return lineno, col_offset
+
+    for node in body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef)) or (
+            node.__class__.__name__ == 'AsyncFunctionDef'
+        ):
+            line, column = _position(node.lineno, node.col_offset)
+            match = RE_DEF_NAME.match(lines[line - 1], column)
+            if match:
+                column = match.start(1)
+            if isinstance(node, ast.ClassDef):
+                yield node.name, 'class', container, (line, column)
+                if container is None:
+                    yield from _iter_ast_names(lines, node.body, node.name)
+            else:
+                yield node.name, 'function', container, (line, column)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = list(getattr(node, 'targets', None) or [node.target])
+            while targets:
+                target = targets.pop(0)
+                if isinstance(target, ast.Name):
+                    yield (
+                        target.id,
+                        'variable',
+                        container,
+                        _position(target.lineno, target.col_offset),
+                    )
+                elif isinstance(target, (ast.Tuple, ast.List)):
+                    targets[:0] = target.elts
+                elif isinstance(target, ast.Starred):
+                    targets.insert(0, target.value)
+        elif isinstance(node, (ast.If, ast.For, ast.While, ast.With)):
+            yield from _iter_ast_names(lines, node.body, container)
+            yield from _iter_ast_names(
+                lines, getattr(node, 'orelse', []), container
+            )
+        elif isinstance(node, ast.Try):
+            for block in (node.body, node.orelse, node.finalbody):
+                yield from _iter_ast_names(lines, block, container)
+            for handler in node.handlers:
+                yield from _iter_ast_names(lines, handler.body, container)
+
+
+def _iter_parso_names(
+    node, container: Optional[str] = None
+) -> Iterator[Tuple]:
+    # Top level and class level definitions: classes, functions and
+    # assignment targets. Compound statements such as `if` and `try` at
+    # these levels are looked into.
+    type_ = node.type
+    if type_ in ('decorated', 'async_stmt', 'async_funcdef'):
+        node = node.children[-1]
+        type_ = node.type
+    if type_ == 'classdef':
+        name = node.name
+        yield name.value, 'class', container, name.start_pos
+        if container is None:
+            yield from _iter_parso_names(node.children[-1], name.value)
+    elif type_ == 'funcdef':
+        name = node.name
+        yield name.value, 'function', container, name.start_pos
+    elif type_ == 'simple_stmt':
+        for child in node.children:
+            if child.type == 'expr_stmt':
+                for name in child.get_defined_names():
+                    if name.parent.type != 'trailer':
+                        yield name.value, 'variable', container, name.start_pos
+    elif type_ in (
+        'file_input',
+        'suite',
+        'if_stmt',
+        'try_stmt',
+        'with_stmt',
+        'for_stmt',
+        'while_stmt',
+    ):
+        for child in node.children:
+            if hasattr(child, 'children'):
+                yield from _iter_parso_names(child, container)
+
+
+def extract_symbols(path: str, code: str) -> List[Symbol]:
+    try:
+        # Unlike `str.splitlines`, splits only where `ast` line numbers do
+        lines = parso.split_lines(code)
+        names = list(_iter_ast_names(lines, ast.parse(code).body))
+    except (SyntaxError, ValueError):
+        # parso recovers from errors
+        names = list(_iter_parso_names(parso.parse(code)))
+    return [
+        Symbol(name, kind, container, path, line, column)
+        for name, kind, container, (line, column) in names
+    ]
+
+
+def iter_python_files(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [
+            d
+            for d in dirnames
+            if not d.startswith('.')
+            and d not in SKIP_DIRS
+            # virtual environment
+            and not os.path.exists(os.path.join(dirpath, d, 'pyvenv.cfg'))
+        ]
+        for filename in filenames:
+            if filename.endswith(('.py', '.pyi')):
+                yield os.path.join(dirpath, filename)
+
+
+def _like_escape(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SymbolIndex:
+    """Top level and class level names of project files.
+
+    Names are stored in SQLite database along with modification time and
+    size of the file, so only changed files are parsed again.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._connection() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.executescript(
+                    """
+                    DROP TABLE IF EXISTS files;
+                    DROP TABLE IF EXISTS symbols;
+                    """
+                )
+            conn.executescript(
+                f"""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                PRAGMA user_version = {SCHEMA_VERSION};
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS symbols (
+                    name TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    container TEXT,
+                    path TEXT NOT NULL,
+                    line INTEGER NOT NULL,
+                    column INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS symbols_name
+                    ON symbols (name COLLATE NOCASE);
+                CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path);
+                """
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread: the indexer writes while requests
+        # read.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = self._local.conn = sqlite3.connect(self.db_path)
+        return conn
+
+    def _read(self, conn: sqlite3.Connection, path: str) -> Optional[Tuple]:
+        # Change of the file to write: path, stat and symbols. Stat is
+        # None if the file is removed. None if the file is not changed.
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None, []
+        row = conn.execute(
+            'SELECT mtime, size FROM files WHERE path = ?', (path,)
+        ).fetchone()
+        if row == (stat.st_mtime, stat.st_size):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                code = f.read().decode('utf-8', 'replace')
+            symbols = extract_symbols(path, code)
+        except Exception as e:
+            logging.debug(f'Failed to index {path}: {e}')
+            symbols = []
+        return path, stat, symbols
+
+    def _write(self, conn: sqlite3.Connection, changes: List[Tuple]):
+        # One transaction for all the changes
+        with self._write_lock, conn:
+            for path, stat, symbols in changes:
+                conn.execute('DELETE FROM symbols WHERE path = ?', (path,))
+                if stat is None:
+                    conn.execute('DELETE FROM files WHERE path = ?', (path,))
+                    continue
+                conn.executemany(
+                    'INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?)', symbols
+                )
+                conn.execute(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                    (path, stat.st_mtime, stat.st_size),
+                )
+
+    def update(self, path: str) -> bool:
+        """Index the file if it is changed. Return True if it was."""
+        conn = self._connection()
+        change = self._read(conn, path)
+        if change is None:
+            return False
+        self._write(conn, [change])
+        return change[1] is not None
+
+    def update_many(self, paths: List[str]) -> int:
+        """Index changed files and forget removed ones at once.
+
+        Return number of indexed files.
+        """
+        conn = self._connection()
+        changes = []
+        for path in paths:
+            change = self._read(conn, path)
+            if change is not None:
+                changes.append(change)
+        if changes:
+            self._write(conn, changes)
+        return sum(1 for change in changes if change[1] is not None)
+
+    def remove(self, path: str):
+        conn = self._connection()
+        with self._write_lock, conn:
+            conn.execute('DELETE FROM symbols WHERE path = ?', (path,))
+            conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def scan(
+        self,
+        roots: List[str],
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> int:
+        """Index changed files under the roots, forget removed ones.
+
+        Return number of indexed files.
+        """
+        start = time.monotonic()
+        seen = set()
+        count = 0
+        for root in roots:
+            for path in iter_python_files(root):
+                if should_stop and should_stop():
+                    return count
+                seen.add(path)
+                if self.update(path):
+                    count += 1
+                    # Let other threads run
+                    time.sleep(0)
+        conn = self._connection()
+        known = [row[0] for row in conn.execute('SELECT path FROM files')]
+        for path in known:
+            if path not in seen:
+                self.remove(path)
+        logging.info(
+            f'Indexed {count} of {len(seen)} files '
+            f'in {time.monotonic() - start:.1f}s'
+        )
+        return count
+
+    def search(self, query: str, limit: int = 100) -> List[Symbol]:
+        """Find symbols fuzzy matching the query.
+
+        Names starting with the query come first, then names containing
+        query characters in order.
+        """
+        if not query:
+            return []
+        conn = self._connection()
+        sql = (
+            'SELECT name, kind, container, path, line, column FROM symbols '
+            "WHERE name LIKE ? ESCAPE '\\' LIMIT ?"
+        )
+        result = [
+            Symbol(*row)
+            for row in conn.execute(sql, (_like_escape(query) + '%', limit))
+        ]
+        if len(result) < limit:
+            pattern = '%'.join(_like_escape(c) for c in query)
+            seen = set(result)
+            for row in conn.execute(sql, (f'%{pattern}%', limit * 2)):
+                symbol = Symbol(*row)
+                if symbol not in seen:
+                    result.append(symbol)
+                    seen.add(symbol)
+        lower = query.lower()
+
+        def _rank(symbol: Symbol):
+            name = symbol.name.lower()
+            if name == lower:
+                return (0, len(name))
+            if name.startswith(lower):
+                return (1, len(name))
+            if lower in name:
+                return (2, len(name))
+            return (3, len(name))
+
+        result.sort(key=_rank)
+        return result[:limit]
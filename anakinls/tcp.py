@@ -0,0 +1,81 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from typing import List, Set
+
+# Server state is kept in module globals, so each client is served by its
+# own server process talking to the client socket as to stdio. Sessions
+# don't see each other's documents, configuration and Jedi environment,
+# and run on different cores.
+sessions: Set[subprocess.Popen] = set()
+sessionsLock = threading.Lock()
+
+
+def _serve_session(conn: socket.socket, address, args: List[str]):
+    try:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'anakinls'] + args, stdin=conn, stdout=conn
+        )
+    except OSError:
+        logging.exception(f'Failed to start session for {address}')
+        return
+    finally:
+        # The session process has its own copy of the socket
+        conn.close()
+    logging.info(f'Session {process.pid} started for {address}')
+    with sessionsLock:
+        sessions.add(process)
+    try:
+        returncode = process.wait()
+    finally:
+        with sessionsLock:
+            sessions.discard(process)
+    logging.info(f'Session {process.pid} exited with code {returncode}')
+
+
+def serve(host: str, port: int, args: List[str]):
+    """Serve every client connected to the address by a new session.
+
+    The args are passed to the session processes.
+    """
+    # Stop the sessions on termination too
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen()
+        host, port = listener.getsockname()[:2]
+        logging.info(f'Listening on {host}:{port}')
+        while True:
+            conn, address = listener.accept()
+            threading.Thread(
+                target=_serve_session,
+                args=(conn, address, args),
+                name='anakinls-session',
+                daemon=True,
+            ).start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        listener.close()
+        with sessionsLock:
+            for process in sessions:
+                process.terminate()
@@ -0,0 +1,114 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import importlib.util
+import os
+import re
+import sys
+import sysconfig
+from collections import Counter
+from typing import Callable, List, Optional
+
+from .symbols import iter_python_files
+
+# Modules which are warmed up by default
+MAX_MODULES = 10
+# Files read to find the most imported modules
+MAX_FILES = 5000
+
+RE_IMPORT = re.compile(
+    r'^[ \t]*(?:from[ \t]+(\w+)[\w.]*[ \t]+import\b'
+    r'|import[ \t]+(\w+(?:[\w.]*[ \t]*,[ \t]*\w+)*))',
+    re.MULTILINE,
+)
+
+
+def _is_stdlib(name: str) -> bool:
+    names = getattr(sys, 'stdlib_module_names', None)
+    if names is not None:
+        return name in names
+    # Python < 3.10: look where the module is installed
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return False
+    if spec is None or not spec.origin:
+        return False
+    if spec.origin in ('built-in', 'frozen'):
+        return True
+    if not os.path.isabs(spec.origin):
+        return False
+    paths = sysconfig.get_paths()
+    origin = os.path.realpath(spec.origin)
+
+    def is_under(key: str) -> bool:
+        path = os.path.realpath(paths[key])
+        try:
+            return os.path.commonpath([origin, path]) == path
+        except ValueError:
+            # Different drives
+            return False
+
+    return is_under('stdlib') and not (
+        is_under('purelib') or is_under('platlib')
+    )
+
+
+def _iter_imports(code: str):
+    for match in RE_IMPORT.finditer(code):
+        if match.group(1):
+            yield match.group(1)
+        else:
+            for name in match.group(2).split(','):
+                yield name.strip().split('.')[0]
+
+
+def _is_local(roots: List[str], name: str) -> bool:
+    return any(
+        os.path.exists(os.path.join(root, name))
+        or os.path.exists(os.path.join(root, f'{name}.py'))
+        for root in roots
+    )
+
+
+def get_most_imported(
+    roots: List[str],
+    limit: int = MAX_MODULES,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> List[str]:
+    """Top level modules imported by the most files under the roots.
+
+    Standard library modules and modules of the roots are skipped.
+    """
+    counter: Counter = Counter()
+    files = 0
+    for root in roots:
+        for path in iter_python_files(root):
+            if files >= MAX_FILES or (should_stop and should_stop()):
+                break
+            files += 1
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    counter.update(set(_iter_imports(f.read())))
+            except OSError:
+                continue
+    result = []
+    for name, _ in counter.most_common():
+        if len(result) >= limit:
+            break
+        if name == '__future__' or _is_stdlib(name):
+            continue
+        if not _is_local(roots, name):
+            result.append(name)
+    return result
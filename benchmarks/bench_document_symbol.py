@@ -0,0 +1,53 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Time building of document symbols for a large generated module.
+
+    python -m benchmarks.bench_document_symbol [--classes N]
+"""
+
+import argparse
+import time
+
+from jedi import Script  # type: ignore
+
+from anakinls import server
+
+from .corpus import generate_module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--classes', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    code = generate_module(args.classes)
+    script = Script(code)
+    names = script.get_names(all_scopes=True)
+    print(f'{len(code.splitlines())} lines, {len(names)} names')
+    for function in (
+        server._document_symbol_hierarchy,
+        server._document_symbol_plain,
+    ):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            function('file:///bench.py', script._code_lines, names)
+            timings.append(time.perf_counter() - start)
+        print(f'{function.__name__}: {min(timings) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
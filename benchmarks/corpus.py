@@ -0,0 +1,62 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Generated Python modules to run benchmarks against."""
+
+from typing import Dict, Tuple
+
+# Number of generated classes per module size
+SIZES = {'small': 2, 'medium': 50, 'large': 1000}
+
+# Every module ends with these lines. Requests are made at `Class0`
+# and at the end of the last line.
+TAIL = ['result = Class0().method(1)', 'os.path.jo']
+
+
+def generate_module(classes: int) -> str:
+    lines = ['import os', '', 'CONSTANT = 1', '']
+    for i in range(classes):
+        lines += [
+            '',
+            f'class Class{i}:',
+            f'    attr{i} = {i}',
+            '',
+            '    def method(self, a, b=None):',
+            '        """Add one to `a`."""',
+            '        x = a + 1',
+            '',
+            '        def inner():',
+            '            return x',
+            '',
+            '        return inner',
+            '',
+            '',
+            f'def function{i}(a):',
+            '    y = os.path.join(a)',
+            '    return y',
+            '',
+            '',
+            f'value{i} = function{i}(CONSTANT)',
+        ]
+    lines += [''] + TAIL
+    return '\n'.join(lines) + '\n'
+
+
+def get_positions(code: str) -> Dict[str, Tuple[int, int]]:
+    """Zero-based (line, character) of the request positions."""
+    lines = code.splitlines()
+    return {
+        'name': (len(lines) - 2, len('result = ')),
+        'end': (len(lines) - 1, len(lines[-1])),
+    }
@@ -0,0 +1,373 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Measure latency and peak memory of the server request handlers.
+
+    python -m benchmarks.run [--repeat N] [--save] [--compare FILE]
+        [--only CASE] [--size SIZE]
+
+Every handler is called with a small, a medium and a large generated
+module. The document version is bumped before each call, so the Jedi
+script is rebuilt as it is after an edit. Diagnostics caches are cleared
+before each `validate` call; `validate_cached` measures the cache hits.
+Latency is measured without memory tracing; peak memory is measured by
+one extra traced call.
+
+The `startup` case is the time from starting `anakinls` process to the
+`initialize` result. Its peak memory is the maximum resident set size
+of the server process.
+
+With `--save` results are stored in `benchmarks/baselines/<version>.json`.
+With `--compare` the run fails if p50 latency of any case is worse than
+in the given baseline by more than `--threshold` percent.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from lsprotocol import types
+from pygls.uris import from_fs_path
+from pygls.workspace import Workspace
+
+from anakinls import server as aserver
+from anakinls.version import __version__
+
+from .corpus import SIZES, generate_module, get_positions
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+class Server:
+    """Enough of the language server for the handlers."""
+
+    def __init__(self, root: str):
+        self.workspace = Workspace(from_fs_path(root), None)
+        self.loop = None
+        self.published = None
+
+    def publish_diagnostics(self, *args):
+        self.published.set_result(args)
+
+
+async def _validate(ls: Server, uri: str):
+    # Same as on open, change and save: the run is scheduled off the loop
+    # and publishes the result in the loop
+    ls.loop = asyncio.get_running_loop()
+    ls.published = ls.loop.create_future()
+    aserver.diagnostics.schedule(ls, uri)
+    await ls.published
+
+
+def _position(position) -> types.Position:
+    return types.Position(line=position[0], character=position[1])
+
+
+def _get_cases(ls: Server, uri: str, code: str) -> Dict[str, Callable]:
+    document = types.TextDocumentIdentifier(uri=uri)
+    positions = get_positions(code)
+    name = _position(positions['name'])
+    end = _position(positions['end'])
+
+    def _run(handler, *args):
+        return asyncio.run(handler(ls, *args))
+
+    def _validate_uncached():
+        # Diagnostics are cached by the document content, which is the
+        # same on every call
+        aserver.diagnosticsCache.clear()
+        aserver.codestyleResults.clear()
+        aserver.savedHashes.clear()
+        _run(_validate, uri)
+
+    return {
+        'completion': lambda: _run(
+            aserver.completions,
+            types.CompletionParams(text_document=document, position=end),
+        ),
+        'hover': lambda: _run(
+            aserver.hover,
+            types.TextDocumentPositionParams(
+                text_document=document, position=name
+            ),
+        ),
+        'definition': lambda: _run(
+            aserver.definition,
+            types.TextDocumentPositionParams(
+                text_document=document, position=name
+            ),
+        ),
+        'references': lambda: _run(
+            aserver.references,
+            types.ReferenceParams(
+                text_document=document,
+                position=name,
+                context=types.ReferenceContext(include_declaration=True),
+            ),
+        ),
+        'document_symbol': lambda: _run(
+            aserver.document_symbol,
+            types.DocumentSymbolParams(text_document=document),
+        ),
+        'validate': _validate_uncached,
+        'validate_cached': lambda: _run(_validate, uri),
+        'formatting': lambda: aserver._formatting(ls, uri),
+        'range_formatting': lambda: aserver._formatting(
+            ls, uri, types.Range(start=name, end=name)
+        ),
+        'on_type_formatting': lambda: aserver.on_type_formatting(
+            ls,
+            types.DocumentOnTypeFormattingParams(
+                text_document=document,
+                position=types.Position(line=name.line + 1, character=0),
+                ch='\n',
+                options=types.FormattingOptions(
+                    tab_size=4, insert_spaces=True
+                ),
+            ),
+        ),
+    }
+
+
+def _percentile(values: List[float], percent: int) -> float:
+    values = sorted(values)
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def _measure(fn: Callable, touch: Callable, repeat: int) -> Dict[str, Any]:
+    # Warm up Jedi caches of the environment
+    touch()
+    fn()
+    timings = []
+    for _ in range(repeat):
+        touch()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    touch()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'p50': statistics.median(timings) * 1000,
+        'p95': _percentile(timings, 95) * 1000,
+        'peak_kb': peak / 1024,
+        'repeat': repeat,
+    }
+
+
+def _send(process: subprocess.Popen, msg_id: int, method: str, params: Any):
+    body = json.dumps(
+        {'jsonrpc': '2.0', 'id': msg_id, 'method': method, 'params': params}
+    ).encode()
+    process.stdin.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    process.stdin.flush()
+
+
+def _receive(process: subprocess.Popen, msg_id: int) -> Dict[str, Any]:
+    while True:
+        length = 0
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                raise EOFError('Server exited')
+            if line == b'\r\n':
+                break
+            name, value = line.decode().split(':', 1)
+            if name.lower() == 'content-length':
+                length = int(value)
+        message = json.loads(process.stdout.read(length))
+        if message.get('id') == msg_id and 'method' not in message:
+            return message
+
+
+def _start_server(root: str) -> float:
+    """Seconds from the server start to the initialize result."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'anakinls'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _send(
+            process,
+            1,
+            'initialize',
+            {
+                'processId': os.getpid(),
+                'rootUri': from_fs_path(root),
+                'capabilities': {},
+            },
+        )
+        _receive(process, 1)
+        elapsed = time.perf_counter() - start
+        _send(process, 2, 'shutdown', None)
+        _receive(process, 2)
+        process.stdin.close()
+        process.wait(10)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return elapsed
+
+
+def _measure_startup(root: str, repeat: int) -> Dict[str, Any]:
+    # Warm up bytecode caches
+    _start_server(root)
+    timings = [_start_server(root) for _ in range(repeat)]
+    try:
+        import resource
+
+        # Kilobytes on Linux. The maximum over the servers started.
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    except ImportError:
+        peak = 0
+    return {
+        'p50': statistics.median(timings) * 1000,
+        'p95': _percentile(timings, 95) * 1000,
+        'peak_kb': peak,
+        'repeat': repeat,
+    }
+
+
+def _print(key: str, result: Dict[str, Any]):
+    print(
+        f'{key:28} p50 {result["p50"]:9.1f}ms  '
+        f'p95 {result["p95"]:9.1f}ms  '
+        f'peak {result["peak_kb"]:9.0f}KB',
+        flush=True,
+    )
+
+
+def run(
+    repeat: int, only: List[str], sizes: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    aserver.completionFunction = aserver._completions_snippets
+    aserver.documentSymbolFunction = aserver._document_symbol_hierarchy
+    aserver.hoverFunction = aserver._docstring
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        ls = Server(root)
+        for size, classes in SIZES.items():
+            if sizes and size not in sizes:
+                continue
+            code = generate_module(classes)
+            path = os.path.join(root, f'{size}.py')
+            with open(path, 'w') as f:
+                f.write(code)
+            uri = from_fs_path(path)
+            ls.workspace.put_text_document(
+                types.TextDocumentItem(
+                    uri=uri, language_id='python', version=0, text=code
+                )
+            )
+            document = ls.workspace.get_text_document(uri)
+
+            def touch():
+                document.version += 1
+
+            for case, fn in _get_cases(ls, uri, code).items():
+                if only and case not in only:
+                    continue
+                key = f'{case}[{size}]'
+                results[key] = _measure(fn, touch, repeat)
+                _print(key, results[key])
+        if not only or 'startup' in only:
+            results['startup'] = _measure_startup(root, repeat)
+            _print('startup', results['startup'])
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]], path: str, threshold: float
+) -> bool:
+    """Print regressions against the baseline. Return True if none."""
+    with open(path) as f:
+        baseline = json.load(f)['results']
+    ok = True
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]['p50']
+        change = (result['p50'] - before) / before * 100 if before else 0
+        if change > threshold:
+            ok = False
+            print(
+                f'REGRESSION {key}: p50 {before:.1f}ms -> '
+                f'{result["p50"]:.1f}ms ({change:+.0f}%)'
+            )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument(
+        '--only', action='append', default=[], help='run only this case'
+    )
+    parser.add_argument(
+        '--size',
+        action='append',
+        default=[],
+        choices=list(SIZES),
+        help='run only with modules of this size',
+    )
+    parser.add_argument('--save', action='store_true')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=20)
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.only, args.size)
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        path = os.path.join(BASELINES, f'{__version__}.json')
+        with open(path, 'w') as f:
+            json.dump(
+                {
+                    'version': __version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'results': results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        print(f'Saved {path}')
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+
+from anakinls.cache import LRUCache, prune_directory
+
+
+def test_lru_max_entries():
+    cache = LRUCache(max_entries=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert 'a' in cache
+    assert 'c' in cache
+    assert cache.get('b') is None
+    assert cache.stats() == {
+        'entries': 2,
+        'size': 0,
+        'hits': 1,
+        'misses': 1,
+        'evictions': 1,
+    }
+
+
+def test_lru_max_size():
+    cache = LRUCache(max_size=10, sizeof=len)
+    cache['a'] = 'x' * 4
+    cache['b'] = 'x' * 4
+    cache['a'] = 'x' * 7
+    assert 'b' not in cache
+    assert cache.stats()['size'] == 7
+    # the most recently used entry is kept even if it is too large
+    cache['c'] = 'x' * 20
+    assert len(cache) == 1
+    assert cache.pop('c') == 'x' * 20
+    assert cache.stats()['size'] == 0
+
+
+def test_lru_resize():
+    cache = LRUCache()
+    for i in range(5):
+        cache[i] = i
+    cache.resize(2, 0)
+    assert len(cache) == 2
+    assert 3 in cache and 4 in cache
+
+
+def test_lru_invalid_value_is_miss():
+    cache = LRUCache()
+    cache['a'] = (1, 'x')
+    assert cache.get('a', is_valid=lambda v: v[0] == 2) is None
+    assert cache.get('a', is_valid=lambda v: v[0] == 1) == (1, 'x')
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    cache.clear_stats()
+    assert cache.stats()['hits'] == cache.stats()['misses'] == 0
+
+
+def test_prune_directory(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for i, name in enumerate(('a', 'b', os.path.join('sub', 'c'))):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 10)
+        os.utime(path, (1000 + i, 1000 + i))
+    # Read recently
+    os.utime(tmp_path / 'a', (2000, 1000))
+    assert prune_directory(str(tmp_path), 25) == 1
+    assert sorted(
+        os.path.relpath(os.path.join(d, f), tmp_path)
+        for d, _, files in os.walk(tmp_path)
+        for f in files
+    ) == ['a', os.path.join('sub', 'c')]
+    assert prune_directory(str(tmp_path), 25) == 0
+    assert prune_directory(str(tmp_path), 0) == 2
@@ -0,0 +1,50 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from anakinls import codestyle
+
+
+def test_check_incremental(monkeypatch):
+    options = codestyle.create_options('', None)
+    functions = [f'def foo{i}(a):\n    return a\n\n\n' for i in range(20)]
+    lines = codestyle.get_lines(
+        'import os\n\n\n' + ''.join(functions) + 'x = 1\n'
+    )
+    result = codestyle.check(None, None, lines, options)
+    assert result.errors == []
+
+    checked = []
+    run_check = codestyle.run_check
+
+    def _run_check(path, lines, *args):
+        checked.append(len(lines))
+        return run_check(path, lines, *args)
+
+    monkeypatch.setattr(codestyle, 'run_check', _run_check)
+    lines = lines[:]
+    # E303 and E225 in the middle
+    lines[43:45] = ['\n', 'def foo10(a):\n', '    return a==1\n']
+    result = codestyle.check(result, None, lines, options)
+    # E402 depends on the previous lines
+    lines = lines + ['import sys\n']
+    result = codestyle.check(result, None, lines, options)
+    assert len(checked) == 2
+    assert max(checked) < len(lines) / 3
+    assert [(line, text[:4]) for line, _, text in result.errors] == [
+        (44, 'E303'),
+        (45, 'E225'),
+        (85, 'E402'),
+    ]
+    # same as the full check
+    assert result.errors == run_check(None, lines, options)[1].errors
@@ -0,0 +1,65 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import sys
+
+import pytest
+
+from anakinls import environment
+
+
+@pytest.fixture()
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    monkeypatch.setattr(sys, 'platform', 'linux')
+    monkeypatch.delenv('VIRTUAL_ENV', raising=False)
+    monkeypatch.delenv('CONDA_PREFIX', raising=False)
+    return tmp_path / 'anakinls'
+
+
+def test_environment_cache(cache_dir):
+    env = environment.get_environment(None)
+    assert not isinstance(env, environment.CachedEnvironment)
+    environment.store(env)
+
+    cached = environment.get_environment(None)
+    assert isinstance(cached, environment.CachedEnvironment)
+    assert cached._subprocess is None
+    assert cached.executable == env.executable
+    assert cached.version_info == env.version_info
+    assert cached.get_sys_path() == env.get_sys_path()
+
+    fresh = environment.revalidate(cached)
+    assert cached.adopt(fresh)
+    assert cached._subprocess is fresh._subprocess
+
+    # Stale sys_path
+    path = cache_dir / environment.CACHE_FILE
+    data = json.loads(path.read_text())
+    data[sys.executable]['info']['sys_path'].append('/nonexistent')
+    path.write_text(json.dumps(data))
+    stale = environment.get_environment(None)
+    assert not stale.adopt(environment.revalidate(stale))
+    assert environment.get_environment(None).get_sys_path() == (
+        env.get_sys_path()
+    )
+
+    # Interpreter changed
+    data = json.loads(path.read_text())
+    data[sys.executable]['mtime'] -= 1
+    path.write_text(json.dumps(data))
+    assert not isinstance(
+        environment.get_environment(None), environment.CachedEnvironment
+    )
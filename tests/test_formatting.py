@@ -0,0 +1,56 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+from parso import split_lines
+
+from anakinls.formatting import format_statement
+
+CODE = """class A:
+    def foo( self,a ):
+        x=[1,
+           2 ,3]
+        if x :
+            pass
+        elif  y==1 :
+            return  x
+        d = {a:
+"""
+
+
+@pytest.mark.parametrize(
+    'line, expected',
+    (
+        (0, (0, ['class A:\n'])),
+        (1, (1, ['    def foo(self, a):\n'])),
+        # inside brackets
+        (2, None),
+        (3, (2, ['        x = [1, 2, 3]\n'])),
+        (6, (6, ['        elif y == 1:\n'])),
+        (7, (7, ['            return x\n'])),
+        (8, None),
+    ),
+)
+def test_format_statement(line, expected):
+    lines = split_lines(CODE, keepends=True)
+    assert format_statement(lines, line, 'pep8', 4) == expected
+
+
+def test_format_statement_header_only():
+    lines = split_lines('x=1\nif x :\n', keepends=True)
+    assert format_statement(lines, 0, 'pep8', 4, header_only=True) is None
+    assert format_statement(lines, 1, 'pep8', 4, header_only=True) == (
+        1,
+        ['if x:\n'],
+    )
@@ -0,0 +1,33 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+
+from jedi import Project, Script
+
+from anakinls.references import ReferenceSearch
+
+
+def test_definition_outside_project(tmp_path):
+    script = Script(
+        'import json\njson.dumps(1)\n',
+        path=str(tmp_path / 'a.py'),
+        project=Project(str(tmp_path)),
+    )
+    search = ReferenceSearch(script, 2, 6)
+    paths = {str(n.module_path) for n in search.start()}
+    # Same as Jedi
+    assert paths == {str(n.module_path) for n in script.get_references(2, 6)}
+    assert json.__file__ in paths
+    assert str(tmp_path / 'a.py') in paths
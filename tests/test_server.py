@@ -12,8 +12,14 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-from unittest.mock import Mock
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+from unittest.mock import AsyncMock, Mock
 
+import pyflakes.api
 import pytest
 from lsprotocol import types
 from pygls.workspace import Document, Workspace
@@ -30,9 +36,32 @@ class Server:
         self.workspace = Workspace('', None)
 
 
+def run(handler, *args):
+    return asyncio.run(handler(*args))
+
+
+def validate(server, uri):
+    # As on open, change and save: wait for the scheduled run to publish
+    async def _validate():
+        server.loop = asyncio.get_running_loop()
+        published = server.loop.create_future()
+        server.publish_diagnostics.side_effect = (
+            lambda *args: published.set_result(None)
+        )
+        aserver.diagnostics.schedule(server, uri)
+        await published
+
+    asyncio.run(_validate())
+
+
 @pytest.fixture()
 def server():
     aserver.scripts.clear()
+    aserver.diagnosticsCache.clear()
+    aserver.workspaceFolders = None
+    aserver.workspaceFolderPaths.clear()
+    aserver.positionResults.clear()
+    aserver.prefetchedPaths.clear()
     return Server()
 
 
@@ -46,7 +75,8 @@ foo"""
     doc = Document(uri, content)
     server.workspace.get_text_document = Mock(return_value=doc)
     aserver.completionFunction = aserver._completions_snippets
-    completion = aserver.completions(
+    completion = run(
+        aserver.completions,
         server,
         types.CompletionParams(
             text_document=types.TextDocumentIdentifier(uri=uri),
@@ -69,6 +99,30 @@ foo"""
     assert item.insert_text == 'foo(${1:a}, b=${2:b})$0'
 
 
+def test_completion_resolve(server):
+    uri = 'file://test_completion_resolve.py'
+    content = '''
+def foo():
+    """docstring"""
+
+foo'''
+    doc = Document(uri, content)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    aserver.completionFunction = aserver._completions
+    completion = run(
+        aserver.completions,
+        server,
+        types.CompletionParams(
+            text_document=types.TextDocumentIdentifier(uri=uri),
+            position=types.Position(line=4, character=3),
+        ),
+    )
+    item = completion.items[0]
+    assert item.documentation is None
+    item = run(aserver.completion_item_resolve, server, item)
+    assert item.documentation == 'docstring'
+
+
 def test_hover(server):
     uri = 'file://test_hover.py'
     content = '''
@@ -80,7 +134,8 @@ foo'''
     doc = Document(uri, content)
     server.workspace.get_text_document = Mock(return_value=doc)
     aserver.hoverFunction = aserver._docstring
-    h = aserver.hover(
+    h = run(
+        aserver.hover,
         server,
         types.TextDocumentPositionParams(
             text_document=types.TextDocumentIdentifier(uri=uri),
@@ -93,6 +148,151 @@ foo'''
     assert h.contents.value == 'foo(a, *, b, c=None)\n\ndocstring'
 
 
+def test_hover_memo(server, monkeypatch):
+    uri = 'file://test_hover_memo.py'
+    doc = Document(uri, 'import os\nos.path\n', version=1)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    calls = []
+
+    def _infer(script, line, column):
+        calls.append((line, column))
+        return aserver.Script.infer(script, line, column)
+
+    monkeypatch.setattr(aserver, 'jediHoverFunction', _infer)
+    aserver.hoverFunction = aserver._docstring
+
+    def _hover(character):
+        return run(
+            aserver.hover,
+            server,
+            types.TextDocumentPositionParams(
+                text_document=types.TextDocumentIdentifier(uri=uri),
+                position=types.Position(line=1, character=character),
+            ),
+        )
+
+    h = _hover(3)
+    assert h is not None
+    # Same name
+    assert _hover(5) is h
+    assert _hover(6) is h
+    assert len(calls) == 1
+    # Other name
+    assert _hover(0) is not h
+    assert len(calls) == 2
+    aserver.did_change(
+        server,
+        types.DidChangeTextDocumentParams(
+            text_document=types.VersionedTextDocumentIdentifier(
+                uri=uri, version=2
+            ),
+            content_changes=[],
+        ),
+    )
+    doc.version = 2
+    assert _hover(4) is not h
+    assert len(calls) == 3
+
+
+def test_script_rebuilt_on_new_version(server):
+    uri = 'file://test_script.py'
+    doc = Document(uri, 'x = 1\n', version=1)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    script = run(aserver.get_script_async, server, uri)
+    assert run(aserver.get_script_async, server, uri) is script
+    doc.apply_change(
+        types.TextDocumentContentChangeEvent_Type1(
+            range=types.Range(
+                start=types.Position(line=0, character=4),
+                end=types.Position(line=0, character=5),
+            ),
+            text='2',
+        )
+    )
+    doc.version = 2
+    aserver.scripts.clear_stats()
+    new_script = run(aserver.get_script_async, server, uri)
+    assert new_script is not script
+    assert new_script._code == 'x = 2\n'
+    result = aserver.get_stats(server, None)
+    assert result['cache/scripts']['hits'] == 0
+    assert result['cache/scripts']['misses'] == 1
+
+
+def test_script_cache_config(server, monkeypatch):
+    assert aserver.scripts.max_entries == 100
+    assert aserver.scripts.max_size == 256 * 1024 * 1024
+    # Restored after the test
+    monkeypatch.setattr(aserver, 'config', dict(aserver.config))
+    for attr in ('max_entries', 'max_size'):
+        monkeypatch.setattr(
+            aserver.scripts, attr, getattr(aserver.scripts, attr)
+        )
+    aserver.did_change_configuration(
+        server,
+        types.DidChangeConfigurationParams(
+            settings={
+                'anakinls': {
+                    'script_cache_max_entries': 2,
+                    'script_cache_max_size': 1,
+                }
+            }
+        ),
+    )
+    assert aserver.scripts.max_entries == 2
+    assert aserver.scripts.max_size == 1024 * 1024
+
+
+def test_document_symbol(server):
+    uri = 'file://test_document_symbol.py'
+    content = """
+from os import path, sep
+
+
+class Foo:
+    attr = 1
+
+    def method(self, a):
+        def inner():
+            pass
+
+
+def bar():
+    x = 1
+"""
+    doc = Document(uri, content)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    params = types.DocumentSymbolParams(
+        text_document=types.TextDocumentIdentifier(uri=uri)
+    )
+
+    def tree(symbols):
+        return [(s.name, tree(s.children or [])) for s in symbols]
+
+    aserver.documentSymbolFunction = aserver._document_symbol_hierarchy
+    result = run(aserver.document_symbol, server, params)
+    assert tree(result) == [
+        ('path', []),
+        ('sep', []),
+        ('Foo', [('attr', []), ('method', [('inner', [])])]),
+        ('bar', [('x', [])]),
+    ]
+    assert str(result[2].range) == '4:6-4:10'
+
+    aserver.documentSymbolFunction = aserver._document_symbol_plain
+    result = run(aserver.document_symbol, server, params)
+    assert [(s.name, s.container_name) for s in result] == [
+        ('path', None),
+        ('sep', None),
+        ('Foo', None),
+        ('attr', 'Foo'),
+        ('method', 'Foo'),
+        ('inner', 'Foo.method'),
+        ('bar', None),
+        ('x', 'bar'),
+    ]
+
+
 def test_diff_to_edits():
     diff = """--- /path/to/original	timestamp
 +++ /path/to/new	timestamp
@@ -140,13 +340,94 @@ def test_diff_to_edits():
     assert str(edits[3].range) == '24:0-24:0'
 
 
+def test_workspace_folder_path(server):
+    for uri in ('file:///ws/proj', 'file:///ws/proj/sub/', 'file:///ws/p'):
+        server.workspace.add_folder(types.WorkspaceFolder(uri=uri, name=uri))
+    assert aserver._get_workspace_folder_path(
+        server, 'file:///ws/proj/sub/a.py'
+    ) == aserver.to_fs_path('file:///ws/proj/sub/')
+    assert aserver._get_workspace_folder_path(
+        server, 'file:///ws/proj/subx/a.py'
+    ) == aserver.to_fs_path('file:///ws/proj')
+    # not a path prefix
+    assert aserver._get_workspace_folder_path(
+        server, 'file:///ws/proj2/a.py'
+    ) == (server.workspace.root_path)
+
+    server.workspace.remove_folder('file:///ws/proj/sub/')
+    aserver.did_change_workspace_folders(server, None)
+    assert aserver._get_workspace_folder_path(
+        server, 'file:///ws/proj/sub/a.py'
+    ) == aserver.to_fs_path('file:///ws/proj')
+
+
+def test_line_edits():
+    old = ['a\n', 'b\n', 'c\n', 'd\n', 'e\n']
+    new = ['a\n', 'B\n', 'c\n', 'e\n', 'f\n']
+    edits = aserver._get_line_edits(old, new, 10)
+    assert [(str(e.range), e.new_text) for e in edits] == [
+        ('11:0-12:0', 'B\n'),
+        ('13:0-14:0', ''),
+        ('15:0-15:0', 'f\n'),
+    ]
+
+
+def test_range_formatting(server):
+    uri = 'file://test_range_formatting.py'
+    content = """x=1
+
+
+def foo( a ):
+    return a
+
+
+@decorator
+def bar( a ):
+    return a+1
+"""
+    doc = Document(uri, content)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    edits = aserver._formatting(
+        server,
+        uri,
+        types.Range(
+            start=types.Position(line=9, character=0),
+            end=types.Position(line=9, character=5),
+        ),
+    )
+    # the statement around the range is formatted, lines of the range only
+    assert [(str(e.range), e.new_text) for e in edits] == [
+        ('9:0-10:0', '    return a + 1\n')
+    ]
+    edits = aserver._formatting(server, uri)
+    assert [str(e.range) for e in edits] == ['0:0-1:0', '3:0-4:0', '8:0-10:0']
+
+
+def test_on_type_formatting(server):
+    uri = 'file://test_on_type_formatting.py'
+    doc = Document(uri, 'def foo( a ):\n    return a+1\n    ')
+    server.workspace.get_text_document = Mock(return_value=doc)
+    edits = aserver.on_type_formatting(
+        server,
+        types.DocumentOnTypeFormattingParams(
+            text_document=types.TextDocumentIdentifier(uri=uri),
+            position=types.Position(line=2, character=4),
+            ch='\n',
+            options=types.FormattingOptions(tab_size=4, insert_spaces=True),
+        ),
+    )
+    assert [(str(e.range), e.new_text) for e in edits] == [
+        ('1:0-2:0', '    return a + 1\n')
+    ]
+
+
 @pytest.mark.parametrize('content', ('pass\n\nif\n', 'def foo(def\n'))
 def test_only_jedi_syntax_error_diagnostic(server, content):
     uri = 'file://test_diagnostic.py'
     doc = Document(uri, content)
     server.workspace.get_text_document = Mock(return_value=doc)
     server.publish_diagnostics = Mock()
-    aserver._validate(server, uri)
+    validate(server, uri)
     assert server.publish_diagnostics.called
     diagnostics = server.publish_diagnostics.call_args[0][1]
     assert len(diagnostics) == 1
@@ -158,12 +439,108 @@ def test_pycodestyle_lineending(server):
     doc = Document(uri, 'while True:\r\n    break\r\n')
     server.workspace.get_text_document = Mock(return_value=doc)
     server.publish_diagnostics = Mock()
-    aserver._validate(server, uri)
+    validate(server, uri)
     assert server.publish_diagnostics.called
     diagnostics = server.publish_diagnostics.call_args[0][1]
     assert len(diagnostics) == 0
 
 
+def test_diagnostics_cache(server, monkeypatch):
+    uri = 'file://test_diagnostics_cache.py'
+    doc = Document(uri, 'import os\nx = y\n')
+    server.workspace.get_text_document = Mock(return_value=doc)
+    server.publish_diagnostics = Mock()
+    calls = []
+
+    def counted(name, module, attr):
+        fn = getattr(module, attr)
+
+        def wrapper(*args, **kwargs):
+            calls.append(name)
+            return fn(*args, **kwargs)
+
+        monkeypatch.setattr(module, attr, wrapper)
+
+    counted('pyflakes', pyflakes.api, 'check')
+    counted('pycodestyle', aserver, '_check_codestyle')
+
+    validate(server, uri)
+    assert calls == ['pyflakes', 'pycodestyle']
+    diagnostics = server.publish_diagnostics.call_args[0][1]
+    assert [d.source for d in diagnostics] == ['pyflakes', 'pyflakes']
+    # unchanged content
+    server.publish_diagnostics.reset_mock()
+    validate(server, uri)
+    assert calls == ['pyflakes', 'pycodestyle']
+    assert server.publish_diagnostics.call_args[0][1] == diagnostics
+    # only pyflakes configuration is changed
+    monkeypatch.setitem(aserver.config, 'pyflakes_errors', [])
+    validate(server, uri)
+    assert calls == ['pyflakes', 'pycodestyle', 'pyflakes']
+
+
+def test_mypy_error_message_is_shown_on_loop(server, monkeypatch):
+    uri = 'file://test_mypy_error.py'
+    doc = Document(uri, 'x = 1\n')
+    server.workspace.get_text_document = Mock(return_value=doc)
+    server.loop = Mock()
+    server.show_message = Mock()
+    monkeypatch.setitem(aserver.config, 'mypy_enabled', True)
+    monkeypatch.setattr(aserver, 'get_mypy_config', Mock(return_value=None))
+
+    def _mypy_check(*args):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(aserver, '_mypy_check', _mypy_check)
+    aserver._get_diagnostics(
+        server, uri, run(aserver.get_script_async, server, uri)
+    )
+    server.show_message.assert_not_called()
+    server.loop.call_soon_threadsafe.assert_called_once_with(
+        server.show_message,
+        'mypy check error: boom',
+        types.MessageType.Warning,
+    )
+
+
+def test_mypy_output_parsing(server, monkeypatch, tmp_path):
+    # Drive letter in the absolute path
+    path = str(tmp_path / 'C:' / 'mod.py')
+    uri = aserver.from_fs_path(path)
+    doc = Document(uri, 'x: int = ""\n')
+    server.workspace.get_text_document = Mock(return_value=doc)
+    monkeypatch.setitem(aserver.config, 'mypy_daemon', True)
+    monkeypatch.setitem(aserver.config, 'diagnostic_on_change', False)
+    monkeypatch.setattr(
+        aserver,
+        'jediEnvironment',
+        Mock(executable=sys.executable, version_info=sys.version_info),
+    )
+    monkeypatch.setattr(aserver, 'get_mypy_config', Mock(return_value=None))
+    output = (
+        f'{path}:1:10: error: Incompatible types (str: x)  [assignment]\n'
+        f'{tmp_path}/other.py:1:1: error: Other file  [misc]\n'
+        f'{os.path.dirname(path)}/../C:/mod.py:1:1: note: Same file\n'
+    )
+    monkeypatch.setattr(
+        aserver.mypyDaemons, 'check', Mock(return_value=output)
+    )
+    result = []
+    aserver._mypy_check(
+        server, uri, run(aserver.get_script_async, server, uri), result
+    )
+    assert [
+        (d.range.start.character, d.severity, d.message) for d in result
+    ] == [
+        (
+            9,
+            types.DiagnosticSeverity.Warning,
+            'Incompatible types (str: x)  [assignment]',
+        ),
+        (0, types.DiagnosticSeverity.Hint, 'Same file'),
+    ]
+
+
 def test_inline_range(server):
     uri = 'file://test_inline.py'
     content = """
@@ -173,7 +550,8 @@ x = int(bar)
     """
     doc = Document(uri, content)
     server.workspace.get_text_document = Mock(return_value=doc)
-    result = aserver.code_action(
+    result = run(
+        aserver.code_action,
         server,
         types.CodeActionParams(
             text_document=types.TextDocumentIdentifier(uri=uri),
@@ -193,3 +571,303 @@ x = int(bar)
     assert edit.range.end.line == 4
     assert edit.range.end.character == 0
     assert edit.new_text == 'x = int(foo + 1)\n'
+
+
+def test_references(server, monkeypatch, tmp_path):
+    files = {
+        'lib.py': 'def helper():\n    pass\n',
+        'use.py': 'from lib import helper\n\nhelper()\n',
+        'other.py': 'helper = None\n',
+        'unrelated.py': 'x = 1\n',
+    }
+    for name, code in files.items():
+        (tmp_path / name).write_text(code)
+    monkeypatch.setattr(
+        aserver, 'jediProject', aserver.get_default_project(str(tmp_path))
+    )
+    server.workspace = Workspace(tmp_path.as_uri(), None)
+    uri = (tmp_path / 'lib.py').as_uri()
+    server.workspace.put_text_document(
+        types.TextDocumentItem(
+            uri=uri, language_id='python', version=1, text=files['lib.py']
+        )
+    )
+    server.send_notification = Mock()
+    params = types.ReferenceParams(
+        text_document=types.TextDocumentIdentifier(uri=uri),
+        position=types.Position(line=0, character=5),
+        context=types.ReferenceContext(include_declaration=True),
+    )
+    expected = [('lib.py', 0, 4), ('use.py', 0, 16), ('use.py', 2, 0)]
+
+    def _key(location):
+        return (
+            location.uri.rsplit('/', 1)[-1],
+            location.range.start.line,
+            location.range.start.character,
+        )
+
+    result = run(aserver.references, server, params)
+    assert sorted(map(_key, result)) == expected
+    server.send_notification.assert_not_called()
+
+    aserver.scripts.clear()
+    params.partial_result_token = 'refs'
+    assert run(aserver.references, server, params) == []
+    streamed = []
+    for call in server.send_notification.call_args_list:
+        assert call.args[0] == types.PROGRESS
+        assert call.args[1].token == 'refs'
+        streamed.extend(call.args[1].value)
+    assert sorted(map(_key, streamed)) == expected
+    # Each file is reported on its own
+    assert server.send_notification.call_count == 2
+
+
+def test_diagnostics_scheduler_drops_stale_runs(server, monkeypatch):
+    uri = 'file://test_scheduler.py'
+    doc = Document(uri, 'x = 1\n', version=1)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    server.publish_diagnostics = Mock()
+    server.loop = asyncio.new_event_loop()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def get_diagnostics(ls, uri, script, is_current=None):
+        calls.append(script._code)
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+        return []
+
+    monkeypatch.setattr(aserver, '_get_diagnostics', get_diagnostics)
+    scheduler = aserver.DiagnosticsScheduler(max_workers=1)
+    scheduler.schedule(server, uri)
+    assert started.wait(5)
+    # superseded while running
+    doc.version = 2
+    scheduler.schedule(server, uri)
+    # superseded before start
+    doc.version = 3
+    scheduler.schedule(server, uri)
+    release.set()
+    scheduler._executor.shutdown(wait=True)
+    server.loop.run_until_complete(asyncio.sleep(0))
+    server.loop.close()
+    assert len(calls) == 2
+    server.publish_diagnostics.assert_called_once_with(uri, [], 3)
+
+
+def test_diagnostics_scheduler_drops_runs_of_closed(server, monkeypatch):
+    uri = 'file://test_scheduler_reopen.py'
+    doc = Document(uri, 'x = 1\n', version=1)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    server.publish_diagnostics = Mock()
+    server.loop = asyncio.new_event_loop()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def get_diagnostics(ls, uri, script, is_current=None):
+        calls.append(script._code)
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+        return []
+
+    monkeypatch.setattr(aserver, '_get_diagnostics', get_diagnostics)
+    scheduler = aserver.DiagnosticsScheduler(max_workers=1)
+    scheduler.schedule(server, uri)
+    assert started.wait(5)
+    # closed and opened again while running
+    scheduler.cancel(uri)
+    aserver.scripts.pop(uri)
+    doc = Document(uri, 'y = 1\n', version=1)
+    server.workspace.get_text_document.return_value = doc
+    scheduler.schedule(server, uri)
+    release.set()
+    scheduler._executor.shutdown(wait=True)
+    server.loop.run_until_complete(asyncio.sleep(0))
+    server.loop.close()
+    assert calls == ['x = 1\n', 'y = 1\n']
+    server.publish_diagnostics.assert_called_once_with(uri, [], 1)
+
+
+def test_diagnostics_debounce(server, monkeypatch):
+    uri = 'file://test_debounce.py'
+    server.loop = asyncio.new_event_loop()
+    monkeypatch.setitem(aserver.config, 'diagnostic_debounce', 50)
+    monkeypatch.setitem(aserver.config, 'diagnostic_max_wait', 120)
+    scheduler = aserver.DiagnosticsScheduler()
+    scheduler.schedule = Mock()
+
+    async def type_text(count):
+        for _ in range(count):
+            scheduler.debounce(server, uri)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+
+    # a short burst is coalesced into one run
+    server.loop.run_until_complete(type_text(3))
+    assert scheduler.schedule.call_count == 1
+    # continuous typing still gets validated after max wait
+    scheduler.schedule.reset_mock()
+    server.loop.run_until_complete(type_text(30))
+    server.loop.close()
+    assert scheduler.schedule.call_count > 1
+
+
+def test_diagnostics_schedule_all(server, monkeypatch):
+    server.loop = asyncio.new_event_loop()
+    uris = ['file:///test_schedule_all_1.py', 'file:///test_schedule_all_2.py']
+    for uri in uris:
+        server.workspace.put_text_document(
+            types.TextDocumentItem(
+                uri=uri, language_id='python', version=1, text='x=y\n'
+            )
+        )
+    monkeypatch.setattr(aserver, 'recentDocuments', dict.fromkeys(uris))
+    monkeypatch.setitem(aserver.config, 'diagnostic_processes', 1)
+    scheduler = aserver.DiagnosticsScheduler()
+    scheduler.schedule = Mock()
+
+    async def wait():
+        while scheduler.schedule.call_count < len(uris):
+            await asyncio.sleep(0.01)
+
+    try:
+        scheduler.schedule_all(server, uris)
+        server.loop.run_until_complete(asyncio.wait_for(wait(), 60))
+    finally:
+        aserver._shutdown_process_pool()
+        server.loop.close()
+    # the most recently used document first
+    assert [c[0][1] for c in scheduler.schedule.call_args_list] == uris[::-1]
+    digest = aserver._get_hash('x=y\n')
+    for uri in uris:
+        pyflakes = aserver.diagnosticsCache.get(
+            aserver._pyflakes_key(uri, digest)
+        )
+        assert [d.source for d in pyflakes] == ['pyflakes']
+        pycodestyle = aserver.diagnosticsCache.get(
+            aserver._pycodestyle_key(server, uri, digest)
+        )
+        assert [d.code for d in pycodestyle] == ['E225']
+        assert aserver.codestyleResults.get(uri).errors
+
+
+def test_warm_up(server, monkeypatch):
+    server.loop = asyncio.new_event_loop()
+    server.client_capabilities = types.ClientCapabilities(
+        window=types.WindowClientCapabilities(work_done_progress=True)
+    )
+    server.progress = Mock()
+    server.progress.create_async = AsyncMock()
+    monkeypatch.setattr(aserver, 'jediProject', aserver.get_default_project())
+    monkeypatch.setattr(aserver, 'warmUp', ['json', 'nonexistent'])
+    warmed = []
+    monkeypatch.setattr(aserver, '_warm_up_module', warmed.append)
+    try:
+        server.loop.run_until_complete(aserver._warm_up(server))
+    finally:
+        server.loop.close()
+    assert warmed == ['json', 'nonexistent']
+    assert [
+        c[0][1].message for c in server.progress.report.call_args_list
+    ] == ['json', 'nonexistent']
+    assert server.progress.begin.called
+    assert server.progress.end.called
+
+
+@pytest.mark.parametrize(
+    'depth, max_files, expected',
+    [
+        (1, 100, ['b.py', 'd.py']),
+        (2, 100, ['b.py', 'c.py', 'd.py']),
+        (2, 1, ['b.py']),
+    ],
+)
+def test_prefetch(server, monkeypatch, tmp_path, depth, max_files, expected):
+    (tmp_path / 'b.py').write_text('import c\n')
+    (tmp_path / 'c.py').write_text('x = 1\n')
+    (tmp_path / 'd.py').write_text('y = 1\n')
+    monkeypatch.setattr(
+        aserver, 'jediProject', aserver.get_default_project(str(tmp_path))
+    )
+    monkeypatch.setitem(aserver.config, 'prefetch_depth', depth)
+    monkeypatch.setitem(aserver.config, 'prefetch_max_files', max_files)
+    uri = (tmp_path / 'a.py').as_uri()
+    doc = Document(uri, 'import b\nfrom d import y\nimport os\n', version=1)
+    server.workspace.get_text_document = Mock(return_value=doc)
+    run(aserver._prefetch, server, uri)
+    prefetched = sorted(aserver.prefetchedPaths)
+    assert [p for p in prefetched if p.startswith(str(tmp_path))] == [
+        str(tmp_path / name) for name in expected
+    ]
+    # Standard library modules are prefetched too, unless over the budget
+    assert any(p.endswith('os.py') for p in prefetched) == (max_files > 1)
+    assert len(prefetched) <= max_files
+
+
+def test_cache_prepopulate(monkeypatch, tmp_path):
+    project = tmp_path / 'project'
+    project.mkdir()
+    (project / 'a.py').write_text('x = 1\n')
+    cache = tmp_path / 'cache'
+    monkeypatch.setattr(aserver.jedi_settings, 'cache_directory', str(cache))
+    monkeypatch.setattr(
+        aserver, 'jediProject', aserver.get_default_project(str(project))
+    )
+    monkeypatch.setattr(
+        aserver, 'jediEnvironment', aserver.get_environment(None)
+    )
+    monkeypatch.setattr(aserver, 'cachePrepopulate', True)
+    monkeypatch.setattr(aserver, 'cacheMaxSize', 0)
+    run(aserver._manage_cache)
+    cached = [
+        os.path.join(d, f) for d, _, files in os.walk(cache) for f in files
+    ]
+    assert [f for f in cached if f.endswith('.pkl')]
+    # Not kept in memory
+    grammar = aserver.jediEnvironment.get_grammar()
+    assert project / 'a.py' not in aserver.parso.cache.parser_cache.get(
+        grammar._hashed, {}
+    )
+    monkeypatch.setattr(aserver, 'cacheMaxSize', 1e-6)
+    run(aserver._manage_cache)
+    assert not [
+        f
+        for d, _, files in os.walk(cache)
+        for f in files
+        if f.endswith('.pkl')
+    ]
+
+
+def test_checkers_are_imported_lazily():
+    code = (
+        'import sys, anakinls.server; '
+        "print([m for m in ('pycodestyle', 'pyflakes', 'yapf') "
+        'if m in sys.modules])'
+    )
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b'[]'
+
+
+def test_cancelled_request_work_is_dropped():
+    release = threading.Event()
+    done = []
+
+    async def main():
+        running = asyncio.ensure_future(aserver._run_jedi(release.wait, 5))
+        queued = asyncio.ensure_future(aserver._run_jedi(done.append, 1))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+    asyncio.run(main())
+    assert not done
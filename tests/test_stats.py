@@ -0,0 +1,41 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from anakinls.stats import Histogram, Stats
+
+
+def test_histogram_window():
+    histogram = Histogram(window=10)
+    for i in range(1, 101):
+        histogram.add(i / 1000)
+    summary = histogram.summary()
+    assert summary['count'] == 100
+    assert round(summary['mean'], 3) == 50.5
+    assert round(summary['max'], 3) == 100
+    # percentiles of the latest values only
+    assert round(summary['p50'], 3) == 96
+    assert round(summary['p95'], 3) == 100
+
+
+def test_stats():
+    stats = Stats()
+    with stats.timer('foo'):
+        pass
+    stats.record('bar', 0.002)
+    summary = stats.summary()
+    assert list(summary) == ['bar', 'foo']
+    assert round(summary['bar']['p50'], 3) == 2
+    assert stats.format().startswith('bar n=1 p50=2.0ms p95=2.0ms; foo n=1')
+    stats.clear()
+    assert stats.summary() == {}
@@ -0,0 +1,125 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+
+import pytest
+
+from anakinls.symbols import SymbolIndex, extract_symbols
+
+CODE = """
+import os
+
+CONSTANT = 1
+a, (b, *c) = 1, (2, 3)
+os.environ['x'] = '1'
+
+
+@decorator
+class Foo(Base):
+    attr: int = 0
+
+    async def method(self):
+        local = 1
+
+    class Inner:
+        hidden = 1
+
+
+if os.name == 'nt':
+    def foo():
+        pass
+else:
+    def foo():
+        pass
+"""
+
+
+@pytest.mark.parametrize('broken', (False, True))
+def test_extract_symbols(broken):
+    # syntax errors are handled by parso
+    code = CODE + ('def (\n' if broken else '')
+    symbols = [
+        (s.name, s.kind, s.container, s.line, s.column)
+        for s in extract_symbols('test.py', code)
+    ]
+    assert symbols == [
+        ('CONSTANT', 'variable', None, 4, 0),
+        ('a', 'variable', None, 5, 0),
+        ('b', 'variable', None, 5, 4),
+        ('c', 'variable', None, 5, 8),
+        ('Foo', 'class', None, 10, 6),
+        ('attr', 'variable', 'Foo', 11, 4),
+        ('method', 'function', 'Foo', 13, 14),
+        ('Inner', 'class', 'Foo', 16, 10),
+        ('foo', 'function', None, 21, 8),
+        ('foo', 'function', None, 24, 8),
+    ]
+
+
+@pytest.mark.parametrize(
+    'code',
+    (
+        '\x0c\ndef foo(): pass\n',
+        "s = '\u2028'\ndef foo(): pass\n",
+        "s = 'ж\x85ж'\ndef foo(): pass\n",
+    ),
+)
+def test_extract_symbols_line_breaks(code):
+    # Only \n, \r\n and \r break lines, as for the tokenizer
+    assert (2, 4) in [
+        (s.line, s.column) for s in extract_symbols('t.py', code)
+    ]
+
+
+def test_symbol_index(tmp_path):
+    project = tmp_path / 'project'
+    (project / '.venv').mkdir(parents=True)
+    (project / '.venv' / 'skipped.py').write_text('skipped = 1\n')
+    module = project / 'module.py'
+    module.write_text(CODE)
+    index = SymbolIndex(str(tmp_path / 'cache' / 'symbols.db'))
+    assert index.scan([str(project)]) == 1
+    # unchanged files are not parsed again
+    assert index.scan([str(project)]) == 0
+    assert index.search('skipped') == []
+    assert sorted(s.name for s in index.search('foo')) == ['Foo', 'foo', 'foo']
+    assert [s.name for s in index.search('CNST')] == ['CONSTANT']
+
+    module.write_text('def bar():\n    pass\n')
+    os.utime(module, (0, 0))
+    assert index.update(str(module))
+    assert index.search('foo') == []
+    assert [s.name for s in index.search('bar')] == ['bar']
+
+    module.unlink()
+    assert index.scan([str(project)]) == 0
+    assert index.search('bar') == []
+
+
+def test_symbol_index_update_many(tmp_path):
+    first = tmp_path / 'first.py'
+    first.write_text('first = 1\n')
+    second = tmp_path / 'second.py'
+    second.write_text('second = 1\n')
+    index = SymbolIndex(str(tmp_path / 'cache' / 'symbols.db'))
+    assert index.update_many([str(first), str(second)]) == 2
+    assert index.update_many([str(first), str(second)]) == 0
+    first.unlink()
+    second.write_text('changed = 1\n')
+    os.utime(second, (0, 0))
+    assert index.update_many([str(first), str(second)]) == 1
+    assert index.search('first') == []
+    assert index.search('second') == []
+    assert [s.name for s in index.search('changed')] == ['changed']
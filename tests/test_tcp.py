@@ -0,0 +1,136 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import re
+import socket
+import subprocess
+import sys
+
+import pytest
+
+
+def _send(conn, message):
+    body = json.dumps(dict(message, jsonrpc='2.0')).encode()
+    conn.sendall(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+
+
+def _receive(stream):
+    length = 0
+    while True:
+        line = stream.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, value = line.split(b':', 1)
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    return json.loads(stream.read(length))
+
+
+def _request(conn, stream, id_, method, params):
+    _send(conn, {'id': id_, 'method': method, 'params': params})
+    while True:
+        message = _receive(stream)
+        if message.get('id') == id_ and 'method' not in message:
+            return message
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='Not supported')
+def test_multi_client(tmp_path):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            '-m',
+            'anakinls',
+            '--tcp',
+            '--multi-client',
+            '--port',
+            '0',
+        ],
+        stderr=subprocess.PIPE,
+    )
+    try:
+        port = None
+        while port is None:
+            line = process.stderr.readline()
+            assert line, 'Server exited'
+            match = re.search(rb'Listening on [^:]+:(\d+)', line)
+            if match:
+                port = int(match.group(1))
+        clients = []
+        for i in range(2):
+            conn = socket.create_connection(('127.0.0.1', port))
+            clients.append((conn, conn.makefile('rb')))
+            root = tmp_path / str(i)
+            root.mkdir()
+            result = _request(
+                conn,
+                clients[-1][1],
+                1,
+                'initialize',
+                {
+                    'processId': None,
+                    'rootUri': root.as_uri(),
+                    'capabilities': {},
+                    'initializationOptions': {'symbol_index': False},
+                },
+            )
+            assert 'capabilities' in result['result']
+        # Same document in both sessions, with different content
+        uri = (tmp_path / 'a.py').as_uri()
+        for i, (conn, _stream) in enumerate(clients):
+            _send(conn, {'method': 'initialized', 'params': {}})
+            _send(
+                conn,
+                {
+                    'method': 'textDocument/didOpen',
+                    'params': {
+                        'textDocument': {
+                            'uri': uri,
+                            'languageId': 'python',
+                            'version': 1,
+                            'text': f'def foo{i}():\n    pass\n',
+                        }
+                    },
+                },
+            )
+        for i, (conn, stream) in enumerate(clients):
+            result = _request(
+                conn,
+                stream,
+                2,
+                'textDocument/documentSymbol',
+                {'textDocument': {'uri': uri}},
+            )
+            assert [s['name'] for s in result['result']] == [f'foo{i}']
+        # The other session keeps working after the first one exits
+        conn, stream = clients[0]
+        _request(conn, stream, 3, 'shutdown', None)
+        _send(conn, {'method': 'exit', 'params': None})
+        assert stream.read() == b''
+        conn, stream = clients[1]
+        result = _request(
+            conn,
+            stream,
+            3,
+            'textDocument/documentSymbol',
+            {'textDocument': {'uri': uri}},
+        )
+        assert [s['name'] for s in result['result']] == ['foo1']
+        for conn, stream in clients:
+            stream.close()
+            conn.close()
+    finally:
+        process.terminate()
+        process.wait(10)
@@ -0,0 +1,45 @@
+# Copyright (C) 2020  Andrii Kolomoiets <andreyk.mad@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+
+from anakinls.warmup import get_most_imported
+
+
+def test_get_most_imported(tmp_path):
+    (tmp_path / 'local').mkdir()
+    (tmp_path / 'a.py').write_text(
+        'import os, numpy as np\nfrom django.db import models\nimport local\n'
+    )
+    (tmp_path / 'b.py').write_text(
+        'from __future__ import annotations\n'
+        'from . import a\n'
+        'if True:\n'
+        '    from django import forms\n'
+        'import django.conf\n'
+    )
+    assert get_most_imported([str(tmp_path)]) == ['django', 'numpy']
+    assert get_most_imported([str(tmp_path)], limit=1) == ['django']
+
+
+def test_get_most_imported_without_stdlib_names(tmp_path, monkeypatch):
+    monkeypatch.delattr(sys, 'stdlib_module_names', raising=False)
+    (tmp_path / 'a.py').write_text(
+        'import os, sys, json, pytest\nimport jedi\nimport nonexistent\n'
+    )
+    assert sorted(get_most_imported([str(tmp_path)])) == [
+        'jedi',
+        'nonexistent',
+        'pytest',
+    ]